@@ -2,8 +2,18 @@
 import pandas as pd
 import numpy as np
 import warnings
-from typing import Dict, Any, List, Tuple
-from optimized_prediction_model import OptimizedCardPredictionModel  # Importa il modello dal file separato
+from scipy.stats import rankdata
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple, Union
+from optimized_prediction_model import (  # Importa il modello dal file separato
+    OptimizedCardPredictionModel, PredictionResult, NUMBA_AVAILABLE, njit,
+    map_player_roles, map_field_zones, frame_key, column_array, min_games_mask, get_referee_severity
+)
+
+try:
+    import numexpr as ne
+except ImportError:  # numexpr è opzionale (solo fallback senza Numba): senza, la somma ponderata usa NumPy
+    ne = None
 
 warnings.filterwarnings('ignore')
 
@@ -30,6 +40,15 @@ THRESHOLDS = {
     'frequent_cards': 5.0          # 90' per cartellino (meno = più pericoloso)
 }
 
+# Ruoli come categoria: i confronti diventano confronti tra codici int8
+ROLE_DTYPE = pd.CategoricalDtype(['DIF', 'CEN', 'ATT', 'GK'])
+ROLE_DIF, ROLE_CEN, ROLE_ATT, ROLE_GK = range(4)
+# Bonus ruolo indicizzato per codice; l'ultimo elemento è il fallback per il codice -1
+ROLE_BONUS_LUT = np.array([0.10, 0.15, 0.05, 0.10, 0.10])
+
+# Somma ponderata dei sei fattori, valutata da numexpr in un unico ciclo fuso
+RISK_EXPRESSION = 'rf*w1 + re*w2 + rfr*w3 + rv*w4 + mb*w5 + rr*w6'
+
 def advanced_normalize_data(df: pd.DataFrame) -> pd.DataFrame:
     """Normalizza i dati per il modello avanzato."""
     df = df.copy()
@@ -55,6 +74,137 @@ def advanced_normalize_data(df: pd.DataFrame) -> pd.DataFrame:
     
     return df
 
+def in_set(values: pd.Series, members: frozenset) -> np.ndarray:
+    """Appartenenza di ogni valore all'insieme `members` (lookup hash O(1) per riga)."""
+    return np.fromiter((v in members for v in values.to_numpy()), dtype=bool, count=len(values))
+
+def flag_mask(flags: pd.Series) -> np.ndarray:
+    """Maschera booleana di una colonna flag: vista senza copia se la colonna è già uint8."""
+    values = flags.to_numpy()
+    return values.view(bool) if values.dtype == np.uint8 else values.astype(bool)
+
+def role_codes(roles: pd.Series) -> np.ndarray:
+    """Codici interi dei ruoli secondo ROLE_DTYPE (-1 per ruoli sconosciuti)."""
+    return roles.astype(ROLE_DTYPE).cat.codes.to_numpy()
+
+# =========================================================================
+# KERNEL NUMERICI DEL MODELLO AVANZATO
+# =========================================================================
+
+def _group_max(values: np.ndarray, groups: np.ndarray, n_groups: int) -> np.ndarray:
+    """Massimo (non negativo) di `values` per gruppo, riportato su ogni riga."""
+    maxima = np.zeros(n_groups)
+    np.maximum.at(maxima, groups, values)
+    return maxima[groups]
+
+def _group_pct_rank(values: np.ndarray, groups: np.ndarray, n_groups: int) -> np.ndarray:
+    """Rango percentile medio (in (0, 1]) di ogni valore all'interno del proprio gruppo."""
+    ranks = np.empty(len(values))
+    for g in range(n_groups):
+        idx = np.flatnonzero(groups == g)
+        ranks[idx] = rankdata(values[idx], method='average') / max(len(idx), 1)
+    return ranks
+
+def _advanced_risk_numpy(rank_falli, fpc, npc, rank_subiti, bonus, codes, role_lut, w, t_eff, t_freq, groups, n_groups):
+    """Fattori di rischio e rischio ponderato normalizzato (versione NumPy/numexpr).
+    Falli fatti e subiti arrivano già come ranghi percentili per gruppo (es. squadra).
+    Restituisce (rischio, fattori) con fattori di forma (5, n): falli, efficacia, frequenza, vittima, ruolo."""
+    n = rank_falli.shape[0]
+    # Matrice dei sei fattori nell'ordine dei pesi
+    factors = np.vstack((
+        rank_falli,
+        np.minimum(1.0, t_eff / np.where(fpc == 0, np.inf, fpc)),
+        np.minimum(1.0, t_freq / np.where(npc == 0, np.inf, npc)),
+        rank_subiti,
+        bonus,
+        role_lut[codes]
+    )).astype(np.float64)
+    # Somma ponderata (fusa da numexpr, altrimenti un solo prodotto matriciale)
+    if ne is not None:
+        names = dict(zip(('rf', 're', 'rfr', 'rv', 'mb', 'rr'), factors))
+        weights = dict(zip(('w1', 'w2', 'w3', 'w4', 'w5', 'w6'), w))
+        risk = np.asarray(ne.evaluate(RISK_EXPRESSION, local_dict={**names, **weights}), dtype=np.float64)
+    else:
+        risk = w @ factors
+    # Normalizzazione al rischio massimo del gruppo
+    max_risk = _group_max(risk, groups, n_groups)
+    risk = np.divide(risk, max_risk, out=np.zeros(n), where=max_risk > 0)
+    return risk, factors[[0, 1, 2, 3, 5]]
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True)
+    def _advanced_risk_kernel(rank_falli, fpc, npc, rank_subiti, bonus, codes, role_lut, w, t_eff, t_freq, groups, n_groups):
+        """Come _advanced_risk_numpy, ma con fattori e somma ponderata in un solo ciclo compilato."""
+        n = rank_falli.shape[0]
+        out = np.zeros(n)
+        comps = np.zeros((5, n))
+        max_risk = np.zeros(n_groups)
+        for i in range(n):
+            g = groups[i]
+            rf = rank_falli[i]
+            re = min(1.0, t_eff / fpc[i]) if fpc[i] != 0 else 0.0
+            rfr = min(1.0, t_freq / npc[i]) if npc[i] != 0 else 0.0
+            rv = rank_subiti[i]
+            rr = role_lut[codes[i]]
+            comps[0, i] = rf
+            comps[1, i] = re
+            comps[2, i] = rfr
+            comps[3, i] = rv
+            comps[4, i] = rr
+            v = rf * w[0] + re * w[1] + rfr * w[2] + rv * w[3] + bonus[i] * w[4] + rr * w[5]
+            out[i] = v
+            max_risk[g] = max(max_risk[g], v)
+        # Secondo passaggio: normalizzazione al rischio massimo del gruppo
+        for i in range(n):
+            g = groups[i]
+            out[i] = out[i] / max_risk[g] if max_risk[g] > 0 else 0.0
+        return out, comps
+
+    _one = np.zeros(1, dtype=np.float32)
+    _int8 = np.zeros(1, dtype=np.int8)
+    _unit = np.ones(1)
+    _advanced_risk_kernel(_unit, _one, _one, _unit, _one, _int8, ROLE_BONUS_LUT, np.zeros(6), 1.0, 1.0, _int8, 1)
+else:
+    _advanced_risk_kernel = _advanced_risk_numpy
+
+def _matchup_bonus_numpy(codes, agg, mid, opp_att_victim, opp_mid_victim):
+    """Bonus matchup di una squadra: 0.15 ai difensori aggressivi se l'avversario ha attaccanti vittime,
+    +0.10 ai centrocampisti aggressivi in mediana se l'avversario ha vittime a centrocampo."""
+    bonus = np.where((codes == ROLE_DIF) & agg & opp_att_victim, 0.15, 0.0)
+    bonus += np.where((codes == ROLE_CEN) & agg & mid & opp_mid_victim, 0.10, 0.0)
+    return bonus
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _matchup_bonus_kernel(codes, agg, mid, opp_att_victim, opp_mid_victim):
+        """Come _matchup_bonus_numpy, in un solo passaggio compilato."""
+        n = codes.shape[0]
+        out = np.zeros(n)
+        for i in range(n):
+            if not agg[i]:
+                continue
+            if codes[i] == ROLE_DIF and opp_att_victim:
+                out[i] = 0.15
+            elif codes[i] == ROLE_CEN and mid[i] and opp_mid_victim:
+                out[i] = 0.10
+        return out
+
+    _matchup_bonus_kernel(np.zeros(1, dtype=np.int8), np.zeros(1, dtype=np.bool_), np.zeros(1, dtype=np.bool_), True, True)
+else:
+    _matchup_bonus_kernel = _matchup_bonus_numpy
+
+# =========================================================================
+# RISULTATO DEL MODELLO AVANZATO
+# =========================================================================
+
+@dataclass
+class AdvancedPredictionResult(PredictionResult):
+    """Risultato del modello avanzato: come PredictionResult, con la chiave 'top_4_predictions'."""
+    sort_column: str = 'Rischio_Finale'
+    top_4_predictions: List = field(default_factory=list)
+
+    _KEYS = PredictionResult._KEYS + ('top_4_predictions',)
+
 # =========================================================================
 # ESTENSIONE AVANZATA DEL MODELLO
 # =========================================================================
@@ -67,23 +217,31 @@ class SuperAdvancedCardPredictionModel(OptimizedCardPredictionModel):
     3. Integrazione falli subiti
     """
     
-    def __init__(self):
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
         super().__init__()
-        self.weights = ADVANCED_WEIGHTS
+        self.weights = ADVANCED_WEIGHTS if weights is None else weights
         self.thresholds = THRESHOLDS
+        self._advanced_w = np.array([
+            self.weights['Falli_Fatti'],
+            self.weights['Falli_per_Cartellino'],
+            self.weights['90s_per_Cartellino'],
+            self.weights['Falli_Subiti'],
+            self.weights['Matchup_Risk'],
+            self.weights['Ruolo']
+        ], dtype=np.float64)
 
     def identify_aggressive_players(self, df: pd.DataFrame) -> pd.DataFrame:
         """Identifica giocatori con alto tasso di falli fatti."""
         df['Is_Aggressive'] = (
-            df.get('Media Falli Fatti 90s Totale', 0) >= self.thresholds['high_fouls_made']
-        )
+            column_array(df, 'Media Falli Fatti 90s Totale', 0) >= self.thresholds['high_fouls_made']
+        ).astype(np.uint8)
         return df
 
     def identify_victim_players(self, df: pd.DataFrame) -> pd.DataFrame:
         """Identifica giocatori che subiscono molti falli."""
         df['Is_Victim'] = (
-            df.get('Media Falli Subiti 90s Totale', 0) >= self.thresholds['high_fouls_suffered']
-        )
+            column_array(df, 'Media Falli Subiti 90s Totale', 0) >= self.thresholds['high_fouls_suffered']
+        ).astype(np.uint8)
         return df
 
     def calculate_matchup_risk(
@@ -95,130 +253,82 @@ class SuperAdvancedCardPredictionModel(OptimizedCardPredictionModel):
         """
         Calcola il rischio derivante dagli accoppiamenti tattici.
         """
-        high_risk_victims = high_risk_victims or []
+        victims_set = frozenset(high_risk_victims or [])
         
         # Identifica ruoli e zone (gestisci assenza Heatmap)
         if 'Heatmap' in home_df.columns:
-            home_df['Zone'] = home_df['Heatmap'].apply(get_field_zone)
+            home_df['Zone'] = map_field_zones(home_df['Heatmap'])
         else:
             home_df['Zone'] = 'midfield'
         
         if 'Heatmap' in away_df.columns:
-            away_df['Zone'] = away_df['Heatmap'].apply(get_field_zone)
+            away_df['Zone'] = map_field_zones(away_df['Heatmap'])
         else:
             away_df['Zone'] = 'midfield'
         
-        # Aggiungi bonus matchup
-        home_df['Matchup_Bonus'] = 0.0
-        away_df['Matchup_Bonus'] = 0.0
-        
-        # CASA: Difensori contro attaccanti trasferta che sono vittime
-        home_defenders = home_df[home_df['Ruolo'] == 'DIF']
-        away_attackers_victims = away_df[
-            (away_df['Ruolo'] == 'ATT') & 
-            (away_df['Player'].isin(high_risk_victims))
-        ]
-        
-        if len(home_defenders) > 0 and len(away_attackers_victims) > 0:
-            home_mask = (home_df['Ruolo'] == 'DIF') & (home_df['Is_Aggressive'] == True)
-            home_df.loc[home_mask, 'Matchup_Bonus'] = 0.15
-        
-        # TRASFERTA: Difensori contro attaccanti casa che sono vittime
-        away_defenders = away_df[away_df['Ruolo'] == 'DIF']
-        home_attackers_victims = home_df[
-            (home_df['Ruolo'] == 'ATT') & 
-            (home_df['Player'].isin(high_risk_victims))
-        ]
-        
-        if len(away_defenders) > 0 and len(home_attackers_victims) > 0:
-            away_mask = (away_df['Ruolo'] == 'DIF') & (away_df['Is_Aggressive'] == True)
-            away_df.loc[away_mask, 'Matchup_Bonus'] = 0.15
-        
-        # CENTROCAMPO: Centrocampisti aggressivi contro zone centrali avversarie
-        home_central_aggressive = home_df[
-            (home_df['Ruolo'] == 'CEN') & 
-            (home_df['Is_Aggressive'] == True) &
-            (home_df['Zone'] == 'midfield')
-        ]
-        away_central_victims = away_df[
-            (away_df['Zone'] == 'midfield') &
-            (away_df['Is_Victim'] == True)
-        ]
-        
-        if len(home_central_aggressive) > 0 and len(away_central_victims) > 0:
-            home_df.loc[home_central_aggressive.index, 'Matchup_Bonus'] += 0.10
-        
-        away_central_aggressive = away_df[
-            (away_df['Ruolo'] == 'CEN') & 
-            (away_df['Is_Aggressive'] == True) &
-            (away_df['Zone'] == 'midfield')
-        ]
-        home_central_victims = home_df[
-            (home_df['Zone'] == 'midfield') &
-            (home_df['Is_Victim'] == True)
-        ]
-        
-        if len(away_central_aggressive) > 0 and len(home_central_victims) > 0:
-            away_df.loc[away_central_aggressive.index, 'Matchup_Bonus'] += 0.10
+        # Colonne lette una sola volta come array NumPy
+        h_role, a_role = role_codes(home_df['Ruolo']), role_codes(away_df['Ruolo'])
+        h_agg, a_agg = flag_mask(home_df['Is_Aggressive']), flag_mask(away_df['Is_Aggressive'])
+        h_victim, a_victim = flag_mask(home_df['Is_Victim']), flag_mask(away_df['Is_Victim'])
+        h_mid = home_df['Zone'].to_numpy() == 'midfield'
+        a_mid = away_df['Zone'].to_numpy() == 'midfield'
+        h_listed = in_set(home_df['Player'], victims_set)
+        a_listed = in_set(away_df['Player'], victims_set)
+        
+        # Condizioni sull'avversario: attaccanti vittime (difensori) e vittime in mediana (centrocampisti)
+        home_att_victim = bool(((h_role == ROLE_ATT) & h_listed).any())
+        away_att_victim = bool(((a_role == ROLE_ATT) & a_listed).any())
+        home_mid_victim = bool((h_mid & h_victim).any())
+        away_mid_victim = bool((a_mid & a_victim).any())
+        
+        # Bonus matchup: un solo passaggio per squadra, assegnato una sola volta
+        home_df['Matchup_Bonus'] = _matchup_bonus_kernel(h_role, h_agg, h_mid, away_att_victim, away_mid_victim)
+        away_df['Matchup_Bonus'] = _matchup_bonus_kernel(a_role, a_agg, a_mid, home_att_victim, home_mid_victim)
         
         return home_df, away_df
 
-    def advanced_calculate_risk_factors(self, df: pd.DataFrame) -> pd.DataFrame:
+    def advanced_calculate_risk_factors(self, df: pd.DataFrame, groups: np.ndarray = None) -> pd.DataFrame:
         """
         Calcola i fattori di rischio avanzati.
+        Con `groups` (codici interi per riga, es. squadra) ranghi e normalizzazioni sono calcolati per gruppo.
         """
         df = advanced_normalize_data(df)
-        
-        # 1. Rischio da Falli Fatti (normalizzato 0-1)
-        max_fouls = df['Media Falli Fatti 90s Totale'].max()
-        df['Rischio_Falli'] = 0.0
-        if max_fouls > 0:
-            df['Rischio_Falli'] = df['Media Falli Fatti 90s Totale'] / max_fouls
-        
-        # 2. Rischio da Efficacia Cartellini
-        fouls_per_card = df['Media Falli per Cartellino Totale'].replace(0, 999)
-        df['Rischio_Efficacia'] = fouls_per_card.apply(
-            lambda x: min(1.0, self.thresholds['card_efficiency'] / x)
-        )
-        
-        # 3. Rischio da Frequenza Cartellini
-        nineties_per_card = df['Media 90s per Cartellino Totale'].replace(0, 999)
-        df['Rischio_Frequenza'] = nineties_per_card.apply(
-            lambda x: min(1.0, self.thresholds['frequent_cards'] / x)
-        )
-        
-        # 4. Rischio da Falli Subiti (normalizzato)
-        max_suffered = df['Media Falli Subiti 90s Totale'].max()
-        df['Rischio_Vittima'] = 0.0
-        if max_suffered > 0:
-            df['Rischio_Vittima'] = df['Media Falli Subiti 90s Totale'] / max_suffered
-        
-        # 5. Bonus Ruolo
-        role_bonus = {
-            'DIF': 0.10, 'CEN': 0.15, 'ATT': 0.05
-        }
-        df['Rischio_Ruolo'] = df['Ruolo'].map(role_bonus).fillna(0.10)
+        if groups is None:
+            groups = np.zeros(len(df), dtype=np.int8)
+        n_groups = int(groups.max()) + 1 if len(groups) else 1
         
         # Assicura presenza di Matchup_Bonus
         if 'Matchup_Bonus' not in df.columns:
             df['Matchup_Bonus'] = 0.0
         
-        # CALCOLO RISCHIO FINALE PONDERATO
-        df['Rischio'] = (
-            df['Rischio_Falli'] * self.weights['Falli_Fatti'] +
-            df['Rischio_Efficacia'] * self.weights['Falli_per_Cartellino'] +
-            df['Rischio_Frequenza'] * self.weights['90s_per_Cartellino'] +
-            df['Rischio_Vittima'] * self.weights['Falli_Subiti'] +
-            df['Matchup_Bonus'] * self.weights['Matchup_Risk'] +
-            df['Rischio_Ruolo'] * self.weights['Ruolo']
+        # Falli fatti/subiti come rango percentile nella squadra: robusto a un singolo valore anomalo
+        rank_falli = _group_pct_rank(df['Media Falli Fatti 90s Totale'].to_numpy(), groups, n_groups)
+        rank_subiti = _group_pct_rank(df['Media Falli Subiti 90s Totale'].to_numpy(), groups, n_groups)
+        
+        # Fattori (falli, efficacia, frequenza, vittima, ruolo) e rischio ponderato normalizzato
+        # calcolati in un unico kernel; 0 in falli/cartellino o 90s/cartellino = rischio 0
+        risk, comps = _advanced_risk_kernel(
+            rank_falli,
+            df['Media Falli per Cartellino Totale'].to_numpy(dtype=np.float32),
+            df['Media 90s per Cartellino Totale'].to_numpy(dtype=np.float32),
+            rank_subiti,
+            df['Matchup_Bonus'].to_numpy(dtype=np.float32),
+            role_codes(df['Ruolo']),
+            ROLE_BONUS_LUT,
+            self._advanced_w,
+            float(self.thresholds['card_efficiency']),
+            float(self.thresholds['frequent_cards']),
+            groups,
+            n_groups
+        )
+        df = df.assign(
+            Rischio_Falli=comps[0],
+            Rischio_Efficacia=comps[1],
+            Rischio_Frequenza=comps[2],
+            Rischio_Vittima=comps[3],
+            Rischio_Ruolo=comps[4],
+            Rischio=risk
         )
-        
-        # Normalizzazione finale (0-1)
-        max_risk = df['Rischio'].max()
-        if max_risk > 0:
-            df['Rischio'] = df['Rischio'] / max_risk
-        else:
-            df['Rischio'] = 0.0
         
         df['Rischio_Finale'] = df['Rischio']
         return df
@@ -229,10 +339,29 @@ class SuperAdvancedCardPredictionModel(OptimizedCardPredictionModel):
         away_df: pd.DataFrame,
         referee_df: pd.DataFrame,
         high_risk_victims: List[str] = None
-    ) -> Dict[str, Any]:
+    ) -> Union[AdvancedPredictionResult, Dict[str, Any]]:
         """
-        Predizione avanzata con matchup.
+        Predizione avanzata con matchup (memorizzata per input e soglie identici).
         """
+        key = (
+            frame_key(home_df), frame_key(away_df), frame_key(referee_df),
+            tuple(sorted(high_risk_victims or [])),
+            tuple(sorted(self.thresholds.items()))
+        )
+        result = self._cache_get(key)
+        if result is None:
+            result = self._predict_match_cards(home_df, away_df, referee_df, high_risk_victims)
+            self._cache_put(key, result)
+        return result
+
+    def _predict_match_cards(
+        self,
+        home_df: pd.DataFrame,
+        away_df: pd.DataFrame,
+        referee_df: pd.DataFrame,
+        high_risk_victims: List[str] = None
+    ) -> Union[AdvancedPredictionResult, Dict[str, Any]]:
+        """Predizione avanzata completa (dict con 'error' se i dati sono insufficienti)."""
         # Usa il metodo base per normalizzazione e filtro
         home_df = advanced_normalize_data(home_df)
         away_df = advanced_normalize_data(away_df)
@@ -240,8 +369,9 @@ class SuperAdvancedCardPredictionModel(OptimizedCardPredictionModel):
         initial_home = len(home_df)
         initial_away = len(away_df)
         
-        home_df = home_df[home_df.get('90s Giocati Totali', 0) >= self.thresholds['min_90s_played']].copy()
-        away_df = away_df[away_df.get('90s Giocati Totali', 0) >= self.thresholds['min_90s_played']].copy()
+        # Filtro posizionale senza copia: i frame sono già copie locali e vengono subito concatenati
+        home_df = home_df.iloc[min_games_mask(home_df, self.thresholds['min_90s_played'])]
+        away_df = away_df.iloc[min_games_mask(away_df, self.thresholds['min_90s_played'])]
         
         excluded_home = initial_home - len(home_df)
         excluded_away = initial_away - len(away_df)
@@ -252,49 +382,51 @@ class SuperAdvancedCardPredictionModel(OptimizedCardPredictionModel):
                 'excluded_count': {'home': excluded_home, 'away': excluded_away}
             }
         
-        # Assegna ruoli
-        if 'Posizione_Primaria' in home_df.columns:
-            home_df['Ruolo'] = home_df['Posizione_Primaria'].apply(get_player_role)
-        else:
-            home_df['Ruolo'] = 'CEN'
+        # Un solo DataFrame per entrambe le squadre (casa prima, poi trasferta)
+        combined = pd.concat([home_df.assign(_side='H'), away_df.assign(_side='A')], ignore_index=True)
+        is_home = combined['_side'].to_numpy() == 'H'
         
-        if 'Posizione_Primaria' in away_df.columns:
-            away_df['Ruolo'] = away_df['Posizione_Primaria'].apply(get_player_role)
+        # Assegna ruoli
+        if 'Posizione_Primaria' in combined.columns:
+            combined['Ruolo'] = map_player_roles(combined['Posizione_Primaria'])
         else:
-            away_df['Ruolo'] = 'CEN'
+            combined['Ruolo'] = 'CEN'
+        combined['Ruolo'] = combined['Ruolo'].astype(ROLE_DTYPE)
         
-        # Identifica categorie
-        home_df = self.identify_aggressive_players(home_df)
-        away_df = self.identify_aggressive_players(away_df)
-        home_df = self.identify_victim_players(home_df)
-        away_df = self.identify_victim_players(away_df)
+        # Identifica categorie (entrambe le squadre insieme; flag uint8)
+        combined = self.identify_aggressive_players(combined)
+        combined = self.identify_victim_players(combined)
         
-        # Matchup
-        home_df, away_df = self.calculate_matchup_risk(home_df, away_df, high_risk_victims or [])
+        # Matchup (l'unico passo che richiede le squadre separate)
+        home_df, away_df = self.calculate_matchup_risk(
+            combined[is_home].copy(), combined[~is_home].copy(), high_risk_victims or []
+        )
+        combined['Zone'] = np.concatenate([home_df['Zone'].to_numpy(), away_df['Zone'].to_numpy()])
+        combined['Matchup_Bonus'] = np.concatenate([
+            home_df['Matchup_Bonus'].to_numpy(), away_df['Matchup_Bonus'].to_numpy()
+        ])
         
-        # Calcola rischi avanzati
-        home_df = self.advanced_calculate_risk_factors(home_df)
-        away_df = self.advanced_calculate_risk_factors(away_df)
+        # Calcola rischi avanzati (normalizzati per squadra)
+        combined = self.advanced_calculate_risk_factors(combined, groups=(~is_home).astype(np.int8))
         
-        # Combina
-        all_predictions_df = pd.concat([home_df, away_df], ignore_index=True)
-        all_predictions_df = all_predictions_df.sort_values('Rischio_Finale', ascending=False).reset_index(drop=True)
+        # Combina (l'ordinamento per rischio avviene solo se richiesto)
+        all_predictions_df = combined.drop(columns='_side')
+        risk_all = all_predictions_df['Rischio_Finale'].to_numpy()
         
-        # Profilo arbitro
-        if referee_df.empty:
-            referee_name = 'Arbitro Default'
-            referee_avg = 4.2
-        else:
-            referee_name = str(referee_df['Nome'].iloc[0])
-            referee_avg = float(referee_df['Gialli a partita'].iloc[0]) if 'Gialli a partita' in referee_df.columns else 4.2
+        # Profilo arbitro (scalari letti direttamente dagli array sottostanti)
+        referee_name = 'Arbitro Default'
+        referee_avg = 4.2
+        if not referee_df.empty:
+            referee_name = str(referee_df['Nome'].to_numpy()[0])
+            if 'Gialli a partita' in referee_df.columns:
+                referee_avg = float(referee_df['Gialli a partita'].to_numpy()[0])
         
-        referee_severity = 'medium'
-        if referee_avg > 4.8: referee_severity = 'strict'
-        elif referee_avg < 3.8: referee_severity = 'permissive'
+        referee_severity = get_referee_severity(referee_avg)
         
         # Cartellini attesi
-        avg_risk = all_predictions_df['Rischio_Finale'].mean()
-        top_4_avg_risk = all_predictions_df.head(4)['Rischio_Finale'].mean() if len(all_predictions_df) >= 4 else avg_risk
+        # Media dei 4 rischi più alti con selezione parziale O(n), senza ordinare tutto
+        avg_risk = risk_all.mean()
+        top_4_avg_risk = np.partition(risk_all, len(risk_all) - 4)[-4:].mean() if len(risk_all) >= 4 else avg_risk
         
         expected_total_cards = round(
             referee_avg * (1 + (avg_risk * 0.3 + top_4_avg_risk * 0.2)), 
@@ -302,13 +434,13 @@ class SuperAdvancedCardPredictionModel(OptimizedCardPredictionModel):
         )
         
         # Statistiche
-        aggressive_home = home_df[home_df['Is_Aggressive'] == True].shape[0]
-        aggressive_away = away_df[away_df['Is_Aggressive'] == True].shape[0]
-        victims_home = home_df[home_df['Is_Victim'] == True].shape[0]
-        victims_away = away_df[away_df['Is_Victim'] == True].shape[0]
+        aggressive_home = int(flag_mask(home_df['Is_Aggressive']).sum())
+        aggressive_away = int(flag_mask(away_df['Is_Aggressive']).sum())
+        victims_home = int(flag_mask(home_df['Is_Victim']).sum())
+        victims_away = int(flag_mask(away_df['Is_Victim']).sum())
         
-        return {
-            'match_info': {
+        return AdvancedPredictionResult(
+            match_info={
                 'home_team': str(home_df['Squadra'].iloc[0]),
                 'away_team': str(away_df['Squadra'].iloc[0]),
                 'expected_total_cards': f"{expected_total_cards:.1f}",
@@ -316,7 +448,7 @@ class SuperAdvancedCardPredictionModel(OptimizedCardPredictionModel):
                 'aggressive_players': {'home': aggressive_home, 'away': aggressive_away},
                 'victim_players': {'home': victims_home, 'away': victims_away}
             },
-            'referee_profile': {
+            referee_profile={
                 'name': referee_name,
                 'Nome': referee_name,
                 'cards_per_game': referee_avg,
@@ -326,17 +458,17 @@ class SuperAdvancedCardPredictionModel(OptimizedCardPredictionModel):
                 'strictness_factor': referee_avg / 4.2,
                 'Description': f"Arbitro con media di {referee_avg:.1f} gialli/partita ({referee_severity})"
             },
-            'all_predictions': all_predictions_df,
-            'top_4_predictions': [],
-            'algorithm_summary': {
+            algorithm_summary={
                 'methodology': 'Modello Avanzato v2.0 - Matchup Tattici + Falli Subiti',
                 'weights_used': self.weights,
                 'thresholds_used': self.thresholds,
                 'min_games_filter_applied': self.thresholds['min_90s_played'],
                 'players_after_filter': {'home': len(home_df), 'away': len(away_df)},
                 'high_risk_victims_used': len(high_risk_victims) if high_risk_victims else 0
-            }
-        }
+            },
+            predictions=all_predictions_df,
+            risk=risk_all
+        )
 
 # Alias
 SuperAdvancedCardPredictionModel = SuperAdvancedCardPredictionModel
@@ -1,9 +1,38 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
 import streamlit as st
 
+try:
+    import pyarrow
+    _CACHE_ERRORS = (ImportError, OSError, ValueError, pyarrow.ArrowException)
+except ImportError:  # pyarrow è opzionale: senza, to_parquet solleva ImportError e si usa solo l'Excel
+    _CACHE_ERRORS = (ImportError, OSError, ValueError)
+
+logger = logging.getLogger(__name__)
+
+# Copie Parquet dei file Excel già letti, indicizzate per hash del contenuto, nella cache utente dell'app
+EXCEL_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'il_mostro' / 'excel'
+# IL_MOSTRO_EXCEL_CACHE=0 disattiva la cache: i file caricati non vengono salvati su disco
+EXCEL_CACHE_ENABLED = os.environ.get('IL_MOSTRO_EXCEL_CACHE', '1') != '0'
+# Numero massimo di copie conservate: oltre, si eliminano le meno usate di recente (mtime)
+EXCEL_CACHE_MAX_FILES = 16
+
+def _prune_excel_cache(cache_dir: Path, max_files: int) -> None:
+    """Mantiene nella cache solo le `max_files` copie Parquet usate più di recente."""
+    files = sorted(cache_dir.glob('*.parquet'), key=lambda p: p.stat().st_mtime, reverse=True)
+    for stale in files[max_files:]:
+        stale.unlink(missing_ok=True)
+
 class DataProcessor:
-    def __init__(self):
+    def __init__(self, excel_cache: bool = EXCEL_CACHE_ENABLED):
+        self.excel_cache = excel_cache
         self.required_columns = [
             'Nome', 'Squadra', 'Posizione', 'Età', 'Minuti_Giocati',
             'Cartellini_Gialli', 'Cartellini_Rossi', 'Falli_Commessi'
@@ -15,7 +44,7 @@ class DataProcessor:
             if uploaded_file.name.endswith('.csv'):
                 df = pd.read_csv(uploaded_file)
             else:
-                df = pd.read_excel(uploaded_file)
+                df = self._read_excel_cached(uploaded_file)
             
             # Verifica colonne richieste
             missing_cols = set(self.required_columns) - set(df.columns)
@@ -31,6 +60,47 @@ class DataProcessor:
             st.error(f"Errore nel caricamento del file: {e}")
             return self.generate_sample_data()
     
+    def _read_excel_cached(self, uploaded_file):
+        """Legge un file Excel riusando la copia Parquet dello stesso contenuto, se presente.
+        Le copie restano tra una sessione e l'altra in EXCEL_CACHE_DIR
+        ($XDG_CACHE_HOME/il_mostro/excel, default ~/.cache/il_mostro/excel), al massimo EXCEL_CACHE_MAX_FILES.
+        Con excel_cache=False (o IL_MOSTRO_EXCEL_CACHE=0) il file viene solo letto, senza scrivere nulla su disco.
+        Senza pyarrow (o con cache non scrivibile) si ripiega sul normale parsing Excel."""
+        content = uploaded_file.getvalue()
+        if not self.excel_cache:
+            return pd.read_excel(io.BytesIO(content))
+        cache_path = EXCEL_CACHE_DIR / f"{hashlib.sha256(content).hexdigest()}.parquet"
+        
+        if cache_path.exists():
+            try:
+                df = pd.read_parquet(cache_path)
+                os.utime(cache_path)  # Segna come usata di recente per la rimozione LRU
+                return df
+            except _CACHE_ERRORS as e:
+                # Cache illeggibile: rimossa e riscritta sotto, così non si ripete a ogni caricamento
+                logger.warning("Cache Parquet %s illeggibile, rilettura dell'Excel: %s", cache_path.name, e)
+                cache_path.unlink(missing_ok=True)
+        
+        df = pd.read_excel(io.BytesIO(content))
+        tmp_path = None
+        try:
+            EXCEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            # Scrittura su file temporaneo e rinomina atomica: una sessione concorrente che carica
+            # lo stesso file non legge mai una copia scritta a metà
+            fd, tmp_path = tempfile.mkstemp(dir=EXCEL_CACHE_DIR, suffix='.tmp')
+            os.close(fd)
+            df.to_parquet(tmp_path, compression='zstd')
+            os.replace(tmp_path, cache_path)
+            tmp_path = None
+            _prune_excel_cache(EXCEL_CACHE_DIR, EXCEL_CACHE_MAX_FILES)
+        except _CACHE_ERRORS as e:
+            # La cache è solo un'ottimizzazione: si restituisce comunque il DataFrame letto
+            logger.warning("Cache Parquet non scritta, uso del solo parsing Excel: %s", e)
+        finally:
+            if tmp_path is not None:
+                Path(tmp_path).unlink(missing_ok=True)
+        return df
+    
     def _clean_data(self, df):
         """Pulisce e valida i dati"""
         # Rimuovi righe con valori mancanti critici
@@ -99,17 +169,18 @@ class DataProcessor:
         cartellini_rossi = []
         falli_commessi = []
         
-        for _, row in df.iterrows():
+        # Tuple semplici invece di una Series per riga
+        for posizione, eta, minuti in df[['Posizione', 'Età', 'Minuti_Giocati']].itertuples(index=False, name=None):
             # Fattori basati sulla posizione
-            if row['Posizione'] == 'Portiere':
+            if posizione == 'Portiere':
                 base_yellow = np.random.poisson(1)
                 base_red = np.random.poisson(0.1)
                 base_fouls = np.random.poisson(8)
-            elif row['Posizione'] == 'Difensore':
+            elif posizione == 'Difensore':
                 base_yellow = np.random.poisson(6)
                 base_red = np.random.poisson(0.3)
                 base_fouls = np.random.poisson(45)
-            elif row['Posizione'] == 'Centrocampista':
+            elif posizione == 'Centrocampista':
                 base_yellow = np.random.poisson(5)
                 base_red = np.random.poisson(0.2)
                 base_fouls = np.random.poisson(35)
@@ -119,10 +190,10 @@ class DataProcessor:
                 base_fouls = np.random.poisson(25)
             
             # Fattore età (giovani più impulsivi)
-            age_factor = 1.3 if row['Età'] < 23 else 1.1 if row['Età'] > 32 else 1.0
+            age_factor = 1.3 if eta < 23 else 1.1 if eta > 32 else 1.0
             
             # Fattore minuti (più minuti = più opportunità per cartellini)
-            minutes_factor = row['Minuti_Giocati'] / 2500
+            minutes_factor = minuti / 2500
             
             final_yellow = int(base_yellow * age_factor * minutes_factor)
             final_red = int(base_red * age_factor * minutes_factor)
@@ -1,8 +1,21 @@
 # optimized_prediction_model.py
+import copy
+import hashlib
 import pandas as pd
 import numpy as np
 import warnings
-from typing import Dict, Any
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
+from typing import Dict, Any, Optional, Union
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:  # Numba è opzionale: senza, i kernel usano NumPy vettoriale
+    njit = None
+    NUMBA_AVAILABLE = False
 
 # =========================================================================
 # COSTANTI E FUNZIONI AUSILIARIE
@@ -17,6 +30,51 @@ WEIGHTS = {
     'Heatmap': 0.10
 }
 
+# Soglie di severità arbitro (gialli/partita): < 3.8 permissivo, > 4.8 severo.
+# Il secondo estremo è il float successivo a 4.8 così che 4.8 resti 'medium' con side='right'.
+_SEV_THRESH = np.array([3.8, np.nextafter(4.8, np.inf)])
+_SEV_LABELS = np.array(['permissive', 'medium', 'strict'])
+
+# Numero massimo di predizioni memorizzate per istanza del modello
+PREDICTION_CACHE_SIZE = 32
+
+# Soglia (righe casa + trasferta) oltre la quale i rischi delle due squadre sono calcolati in parallelo
+PARALLEL_MIN_ROWS = 200
+
+def frame_key(df: pd.DataFrame) -> tuple:
+    """Chiave stabile per il contenuto di un DataFrame: colonne, dtype, numero di righe e digest
+    degli hash di riga nel loro ordine (le stesse righe permutate danno chiavi diverse)."""
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    digest = hashlib.blake2b(row_hashes.tobytes(), digest_size=16).digest()
+    return tuple(df.columns), tuple(map(str, df.dtypes)), len(df), digest
+
+def _fast_concat(a: pd.DataFrame, b: pd.DataFrame) -> pd.DataFrame:
+    """Concatena due DataFrame con le stesse colonne copiando direttamente gli array NumPy.
+    Le colonne non numeriche (o con dtype diversi) passano per pandas."""
+    if not (a.columns.equals(b.columns) and a.columns.is_unique):
+        return pd.concat([a, b], ignore_index=True)
+    data = {}
+    for col in a.columns:
+        left, right = a[col], b[col]
+        if isinstance(left.dtype, np.dtype) and left.dtype == right.dtype and left.dtype != object:
+            data[col] = np.concatenate([left.to_numpy(), right.to_numpy()])
+        else:
+            data[col] = pd.concat([left, right], ignore_index=True)
+    return pd.DataFrame(data, index=pd.RangeIndex(len(a) + len(b)))
+
+def min_games_mask(df: pd.DataFrame, min_90s: float) -> np.ndarray:
+    """Maschera NumPy dei giocatori con almeno `min_90s` partite da 90' (tutti se la colonna manca)."""
+    try:
+        return np.asarray(df['90s Giocati Totali'].to_numpy() >= min_90s)
+    except KeyError:
+        return np.ones(len(df), dtype=bool)
+
+def column_array(df: pd.DataFrame, col: str, default: float) -> np.ndarray:
+    """Colonna come array float64 (array costante `default` se la colonna manca)."""
+    if col in df.columns:
+        return df[col].to_numpy(dtype=np.float64)
+    return np.full(len(df), default, dtype=np.float64)
+
 def normalize_data(df: pd.DataFrame) -> pd.DataFrame:
     """Funzione placeholder per la normalizzazione dei dati prima del calcolo."""
     df = df.copy()
@@ -41,6 +99,7 @@ def get_player_role(pos: str) -> str:
     if 'A' in pos or 'FW' in pos or 'ST' in pos: return 'ATT'
     return 'CEN' 
 
+@lru_cache(maxsize=1024)
 def get_field_zone(heatmap: str) -> str:
     """Funzione placeholder per la zona del campo (usata per il rischio)"""
     heatmap = str(heatmap).lower()
@@ -51,6 +110,31 @@ def get_field_zone(heatmap: str) -> str:
     else:
         return 'midfield'
 
+# Ruoli dei codici posizione noti, calcolati una volta all'import
+_POS_TO_ROLE = {
+    pos: get_player_role(pos)
+    for pos in ('GK', 'DF', 'CB', 'RB', 'LB', 'MF', 'DM', 'CM', 'AM', 'LM', 'RM',
+                'FW', 'ST', 'LW', 'RW', 'POR', 'DIF', 'CEN', 'ATT')
+}
+
+def _map_distinct(values: pd.Series, func, known: Dict = None) -> pd.Series:
+    """Applica `func` una sola volta per valore distinto (pd.factorize) e ricompone la colonna per codice.
+    Tutti i valori mancanti (None/NaN) condividono il codice -1, risolto con func(np.nan)."""
+    known = known or {}
+    codes, uniques = pd.factorize(values)
+    lut = [known[v] if v in known else func(v) for v in uniques]
+    lut.append(func(np.nan))  # Ultimo elemento: fallback per il codice -1
+    # dtype inferito da pandas, come il precedente .apply (str su pandas 3, object prima)
+    return pd.Series(np.array(lut, dtype=object)[codes], index=values.index, name=values.name)
+
+def map_player_roles(positions: pd.Series) -> pd.Series:
+    """Ruoli per una colonna Posizione_Primaria (dizionario precalcolato, get_player_role solo per codici nuovi)."""
+    return _map_distinct(positions, get_player_role, _POS_TO_ROLE)
+
+def map_field_zones(heatmaps: pd.Series) -> pd.Series:
+    """Zone per una colonna Heatmap, valutando get_field_zone una volta per descrizione distinta."""
+    return _map_distinct(heatmaps, get_field_zone)
+
 def get_player_role_category(role: str) -> str:
     """Funzione placeholder per la categoria di ruolo (es. Attaccante, Difensore)."""
     role_map = {
@@ -60,54 +144,172 @@ def get_player_role_category(role: str) -> str:
     }
     return role_map.get(role, role)
 
+def get_referee_severity(referee_avg):
+    """Classifica la severità dell'arbitro dalla media gialli/partita (scalare o array di medie)."""
+    referee_avg = np.asarray(referee_avg, dtype=np.float64)
+    # searchsorted colloca i NaN oltre ogni soglia: una media mancante resta 'medium' come nell'if/elif originale
+    codes = np.where(np.isnan(referee_avg), 1, np.searchsorted(_SEV_THRESH, referee_avg, side='right'))
+    labels = _SEV_LABELS[codes]
+    return str(labels) if np.ndim(labels) == 0 else labels
+
+# =========================================================================
+# KERNEL NUMERICI
+# =========================================================================
+
+def _risk_kernel_numpy(falli, eff, freq, ruolo, heat, w) -> np.ndarray:
+    """Somma ponderata dei cinque fattori normalizzata al massimo (versione NumPy)."""
+    risk = np.column_stack((falli, eff, freq, ruolo, heat)) @ w
+    max_risk = risk.max() if risk.size else 0.0
+    return risk / max_risk if max_risk > 0 else np.zeros_like(risk)
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True)
+    def _risk_kernel(falli, eff, freq, ruolo, heat, w):
+        """Somma ponderata dei cinque fattori normalizzata al massimo (ciclo compilato)."""
+        n = falli.shape[0]
+        out = np.empty(n)
+        max_risk = 0.0
+        for i in range(n):
+            v = falli[i] * w[0] + eff[i] * w[1] + freq[i] * w[2] + ruolo[i] * w[3] + heat[i] * w[4]
+            out[i] = v
+            if v > max_risk:
+                max_risk = v
+        if max_risk > 0:
+            for i in range(n):
+                out[i] /= max_risk
+        else:
+            out[:] = 0.0
+        return out
+
+    # Compilazione anticipata all'import per evitare la latenza alla prima predizione
+    _risk_kernel(np.zeros(1), np.zeros(1), np.zeros(1), np.zeros(1), np.zeros(1), np.zeros(5))
+else:
+    _risk_kernel = _risk_kernel_numpy
+
+# =========================================================================
+# RISULTATO DELLA PREDIZIONE
+# =========================================================================
+
+@dataclass
+class PredictionResult:
+    """Risultato di una predizione. `all_predictions` viene ordinato solo al primo accesso;
+    l'accesso per chiave (result['match_info']) resta compatibile con il vecchio dict."""
+    match_info: Dict
+    referee_profile: Dict
+    algorithm_summary: Dict
+    predictions: pd.DataFrame = field(repr=False)
+    sort_column: str = 'Rischio'
+    risk: Optional[np.ndarray] = field(default=None, repr=False)
+
+    _KEYS = ('match_info', 'referee_profile', 'all_predictions', 'algorithm_summary')
+
+    @cached_property
+    def all_predictions(self) -> pd.DataFrame:
+        """Predizioni ordinate per rischio decrescente (ordinamento stabile su ndarray)."""
+        risk = self.risk if self.risk is not None else self.predictions[self.sort_column].to_numpy()
+        ordered = self.predictions.take(np.argsort(-risk, kind='stable'))
+        ordered.index = pd.RangeIndex(len(ordered))
+        return ordered
+
+    def keys(self):
+        return self._KEYS
+
+    def values(self):
+        return [self[key] for key in self._KEYS]
+
+    def items(self):
+        return [(key, self[key]) for key in self._KEYS]
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self) -> int:
+        return len(self._KEYS)
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self._KEYS else default
+
+    def __contains__(self, key) -> bool:
+        return key in self._KEYS
+
+    def __getitem__(self, key: str):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
 # =========================================================================
 # CLASSE MODELLO
 # =========================================================================
 
 class OptimizedCardPredictionModel:
     
-    def __init__(self):
-        self.weights = WEIGHTS
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = WEIGHTS if weights is None else weights
+        self._cache: OrderedDict = OrderedDict()
+        # Pesi e tabelle bonus precalcolati una volta (i fattori 0.5 sono già applicati)
+        self._w = np.array([
+            self.weights['Falli_Fatti'],
+            self.weights['Falli_per_Cartellino'] * 0.5,
+            self.weights['90s_per_Cartellino'] * 0.5,
+            self.weights['Ruolo'],
+            self.weights['Heatmap']
+        ], dtype=np.float64)
+        # Bonus indicizzati per codice categoriale; l'ultimo elemento (codice -1, categoria
+        # sconosciuta) è il bonus di fallback 0.10
+        self._role_categories = pd.Index(['DIF', 'CEN', 'ATT'])
+        self._role_lut = np.array([0.10, 0.15, 0.05, 0.10])
+        self._zone_categories = pd.Index(['attack', 'midfield', 'defense'])
+        self._zone_lut = np.array([0.05, 0.15, 0.10, 0.10])
+
+    def _cache_get(self, key) -> Any:
+        """Restituisce una copia della predizione memorizzata per la chiave (None se assente)."""
+        if key not in self._cache:
+            return None
+        self._cache.move_to_end(key)
+        return copy.deepcopy(self._cache[key])
+
+    def _cache_put(self, key, result) -> None:
+        """Memorizza una copia della predizione, scartando la meno recente oltre il limite."""
+        self._cache[key] = copy.deepcopy(result)
+        if len(self._cache) > PREDICTION_CACHE_SIZE:
+            self._cache.popitem(last=False)
 
     def calculate_risk_factors(self, df: pd.DataFrame) -> pd.DataFrame:
         """Calcola i fattori di rischio base per i giocatori."""
         df = normalize_data(df)
-        df['Rischio_Falli'] = df.get('Media Falli Fatti 90s Totale', 0)
+        # Le nuove colonne sono accumulate in un dict e agganciate con un solo assign
+        new_cols = {'Rischio_Falli': column_array(df, 'Media Falli Fatti 90s Totale', 0)}
         
         # Calcola l'inverso per Falli per Cartellino e 90s per Cartellino 
-        fouls_per_card = df.get('Media Falli per Cartellino Totale', 999).replace(0, 999)
-        df['Rischio_Efficacia'] = fouls_per_card.rdiv(1)
-        nineties_per_card = df.get('Media 90s per Cartellino Totale', 999).replace(0, 999)
-        df['Rischio_Frequenza'] = nineties_per_card.rdiv(1)
+        fouls_per_card = column_array(df, 'Media Falli per Cartellino Totale', 999)
+        new_cols['Rischio_Efficacia'] = 1 / np.where(fouls_per_card == 0, 999, fouls_per_card)
+        nineties_per_card = column_array(df, 'Media 90s per Cartellino Totale', 999)
+        new_cols['Rischio_Frequenza'] = 1 / np.where(nineties_per_card == 0, 999, nineties_per_card)
         
         # Bonus ruolo
         if 'Posizione_Primaria' in df.columns:
-            df['Ruolo'] = df['Posizione_Primaria'].apply(get_player_role)
+            new_cols['Ruolo'] = map_player_roles(df['Posizione_Primaria'])
         else:
-            df['Ruolo'] = 'CEN'
-        role_bonus = {'DIF': 0.10, 'CEN': 0.15, 'ATT': 0.05}
-        df['Rischio_Ruolo'] = df['Ruolo'].map(role_bonus).fillna(0.10)
+            new_cols['Ruolo'] = pd.Series('CEN', index=df.index)
+        new_cols['Rischio_Ruolo'] = self._role_lut[self._role_categories.get_indexer(new_cols['Ruolo'])]
         
         # Bonus heatmap
-        df['Zone'] = df.get('Heatmap', 'midfield').apply(get_field_zone)
-        heatmap_bonus = {'attack': 0.05, 'midfield': 0.15, 'defense': 0.10}
-        df['Rischio_Heatmap'] = df['Zone'].map(heatmap_bonus).fillna(0.10)
+        if 'Heatmap' in df.columns:
+            new_cols['Zone'] = map_field_zones(df['Heatmap'])
+        else:
+            new_cols['Zone'] = pd.Series('midfield', index=df.index)
+        new_cols['Rischio_Heatmap'] = self._zone_lut[self._zone_categories.get_indexer(new_cols['Zone'])]
+        df = df.assign(**new_cols)
         
-        # Combinazione di rischio ponderata
-        df['Rischio'] = (
-            df['Rischio_Falli'] * self.weights['Falli_Fatti'] +
-            df['Rischio_Efficacia'] * self.weights['Falli_per_Cartellino'] * 0.5 + 
-            df['Rischio_Frequenza'] * self.weights['90s_per_Cartellino'] * 0.5 +
-            df['Rischio_Ruolo'] * self.weights['Ruolo'] +
-            df['Rischio_Heatmap'] * self.weights['Heatmap']
+        # Combinazione di rischio ponderata, normalizzata a rischio massimo 1.0
+        df['Rischio'] = _risk_kernel(
+            new_cols['Rischio_Falli'],
+            new_cols['Rischio_Efficacia'],
+            new_cols['Rischio_Frequenza'],
+            new_cols['Rischio_Ruolo'],
+            new_cols['Rischio_Heatmap'],
+            self._w
         )
-        
-        # Normalizzazione: porta il rischio massimo a 1.0
-        max_risk = df['Rischio'].max()
-        if max_risk > 0:
-            df['Rischio'] = df['Rischio'] / max_risk
-        else:
-            df['Rischio'] = 0
             
         df['Rischio_Finale'] = df['Rischio']
         return df
@@ -118,8 +320,22 @@ class OptimizedCardPredictionModel:
         home_df: pd.DataFrame,
         away_df: pd.DataFrame,
         referee_df: pd.DataFrame
-    ) -> Dict:
-        """Esegue la predizione completa per una partita."""
+    ) -> Union[PredictionResult, Dict]:
+        """Esegue la predizione completa per una partita (memorizzata per input identici)."""
+        key = (frame_key(home_df), frame_key(away_df), frame_key(referee_df))
+        result = self._cache_get(key)
+        if result is None:
+            result = self._predict_match_cards(home_df, away_df, referee_df)
+            self._cache_put(key, result)
+        return result
+
+    def _predict_match_cards(
+        self,
+        home_df: pd.DataFrame,
+        away_df: pd.DataFrame,
+        referee_df: pd.DataFrame
+    ) -> Union[PredictionResult, Dict]:
+        """Esegue la predizione completa per una partita (dict con 'error' se i dati sono insufficienti)."""
         
         # 1. Normalizza e filtra i dati
         home_df = normalize_data(home_df)
@@ -128,8 +344,8 @@ class OptimizedCardPredictionModel:
         # Filtro >=5 per coerenza
         initial_home = len(home_df)
         initial_away = len(away_df)
-        home_df = home_df[home_df.get('90s Giocati Totali', 0) >= 5]
-        away_df = away_df[away_df.get('90s Giocati Totali', 0) >= 5]
+        home_df = home_df.iloc[min_games_mask(home_df, 5)]
+        away_df = away_df.iloc[min_games_mask(away_df, 5)]
         
         excluded_home = initial_home - len(home_df)
         excluded_away = initial_away - len(away_df)
@@ -140,47 +356,53 @@ class OptimizedCardPredictionModel:
                 'excluded_count': {'home': excluded_home, 'away': excluded_away}
             }
             
-        # 2. Calcola i rischi
-        home_df = self.calculate_risk_factors(home_df)
-        away_df = self.calculate_risk_factors(away_df)
+        # 2. Calcola i rischi (in parallelo per rose grandi: pandas/NumPy rilasciano il GIL)
+        if len(home_df) + len(away_df) > PARALLEL_MIN_ROWS:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                home_future = executor.submit(self.calculate_risk_factors, home_df)
+                away_future = executor.submit(self.calculate_risk_factors, away_df)
+                home_df, away_df = home_future.result(), away_future.result()
+        else:
+            home_df = self.calculate_risk_factors(home_df)
+            away_df = self.calculate_risk_factors(away_df)
         
-        all_predictions_df = pd.concat([home_df, away_df], ignore_index=True)
+        all_predictions_df = _fast_concat(home_df, away_df)
+        risk_all = np.concatenate([home_df['Rischio'].to_numpy(), away_df['Rischio'].to_numpy()])
 
-        # 3. Determina profilo arbitro
-        if referee_df.empty:
-            referee_name = 'Arbitro Default'
-            referee_avg = 4.2
-        else:
-            referee_name = str(referee_df['Nome'].iloc[0])
-            referee_avg = float(referee_df['Gialli a partita'].iloc[0]) if 'Gialli a partita' in referee_df.columns else 4.2
+        # 3. Determina profilo arbitro (scalari letti direttamente dagli array sottostanti)
+        referee_name = 'Arbitro Default'
+        referee_avg = 4.2
+        if not referee_df.empty:
+            referee_name = str(referee_df['Nome'].to_numpy()[0])
+            if 'Gialli a partita' in referee_df.columns:
+                referee_avg = float(referee_df['Gialli a partita'].to_numpy()[0])
         
-        referee_severity = 'medium'
-        if referee_avg > 4.8: referee_severity = 'strict'
-        elif referee_avg < 3.8: referee_severity = 'permissive'
+        referee_severity = get_referee_severity(referee_avg)
         
         # 4. Calcola Cartellini Totali Attesi
-        avg_risk = all_predictions_df['Rischio'].mean()
+        avg_risk = risk_all.mean()
         expected_total_cards = round(referee_avg * (1 + avg_risk * 0.5), 1)
 
-        # 5. Genera Output
-        return {
-            'match_info': {
-                'home_team': str(home_df['Squadra'].iloc[0]),
-                'away_team': str(away_df['Squadra'].iloc[0]),
+        # 5. Genera Output (l'ordinamento delle predizioni avviene solo se richiesto)
+        return PredictionResult(
+            match_info={
+                'home_team': str(home_df['Squadra'].to_numpy()[0]),
+                'away_team': str(away_df['Squadra'].to_numpy()[0]),
                 'expected_total_cards': f"{expected_total_cards:.1f}",
                 'algorithm_confidence': 'High', 
             },
-            'referee_profile': {
+            referee_profile={
                 'Nome': referee_name,
                 'Gialli_a_partita': referee_avg,
                 'Severity': referee_severity,
                 'Description': f"Arbitro con media di {referee_avg:.1f} cartellini a partita.",
             },
-            'all_predictions': all_predictions_df.sort_values('Rischio', ascending=False).reset_index(drop=True),
-            'algorithm_summary': {
+            algorithm_summary={
                 'methodology': 'Modello Ottimizzato - Filtro 5 Partite',
                 'weights_used': self.weights,
                 'min_games_filter_applied': 5,
                 'players_after_filter': {'home': len(home_df), 'away': len(away_df)}
-            }
-        }
\ No newline at end of file
+            },
+            predictions=all_predictions_df,
+            risk=risk_all
+        )
\ No newline at end of file
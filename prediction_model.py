@@ -1,24 +1,79 @@
 import pandas as pd
 import numpy as np
 import re
-import warnings
+from collections import namedtuple
+from functools import lru_cache
 from typing import Dict, List, Tuple, Optional
-
-warnings.filterwarnings('ignore')
+from optimized_prediction_model import NUMBA_AVAILABLE, njit
 
 # =========================================================================
 # FUNZIONI DI SUPPORTO
 # =========================================================================
 
+# Colonne di rischio tenute in float32 (metà banda di memoria). Le metriche confrontate con una soglia
+# (falli fatti/subiti, 90s per cartellino, ritardo) restano float64: l'arrotondamento float32 sposta
+# i giocatori sul confine, es. ritardo 50.0 contro (5/3) * 30 nel fattore ritardo
+FLOAT32_METRIC_COLS = ['Media_Falli_per_Cartellino_Totale', 'Cartellini_Gialli_Totali']
+
+# Mediane globali dei giocatori (accesso per attributo; np.asarray(gm) per i kernel)
+GlobalMedians = namedtuple(
+    'GlobalMedians', 'fouls_suffered_90s fouls_committed_90s games_per_card fouls_per_card card_delay'
+)
+
+# Codici interi di categoria ruolo, sottocategoria e lato per la tabella di compatibilità
+ROLE_MAINS = ('Central_Mid', 'Forward', 'Defender', 'Flank', 'Other')
+ROLE_SUBS = ('Central', 'Flank')
+SIDES = ('L', 'R', 'V')
+_ROLE_MAIN_CODE = {name: code for code, name in enumerate(ROLE_MAINS)}
+_ROLE_SUB_CODE = {name: code for code, name in enumerate(ROLE_SUBS)}
+_SIDE_CODE = {name: code for code, name in enumerate(SIDES)}
+
+# Espressioni regolari compilate una volta all'import
+_NAME_STRIP_RE = re.compile(r'[^\w\s-]')
+_NAME_COLLAPSE_RE = re.compile(r'[\s-]+')
+_SIDE_R_RE = re.compile(r'(right|destra|rwb?|rb?|right flank)')
+_SIDE_L_RE = re.compile(r'(left|sinistra|lwb?|lb?|left flank)')
+
 def normalize_name(name):
     """Normalizza un nome rimuovendo accenti, spazi e caratteri speciali."""
     if pd.isna(name):
         return ""
     name = str(name).lower()
-    name = re.sub(r'[^\w\s-]', '', name)
-    name = re.sub(r'[\s-]+', '_', name)
+    name = _NAME_STRIP_RE.sub('', name)
+    name = _NAME_COLLAPSE_RE.sub('_', name)
     return name
 
+def safe_divide(numerator: pd.Series, denominator: pd.Series) -> np.ndarray:
+    """Divisione elemento per elemento con 0 dove il denominatore è nullo (maschera e divisione in un passaggio)."""
+    num = numerator.to_numpy(dtype=np.float64)
+    den = denominator.to_numpy(dtype=np.float64)
+    return np.divide(num, den, out=np.zeros_like(num), where=den != 0)
+
+def category_mask(values: pd.Series, predicate) -> np.ndarray:
+    """Maschera booleana per riga valutando `predicate` una sola volta per categoria distinta (lookup per codice)."""
+    categorical = values.astype('category')
+    # L'ultimo elemento è il fallback (False) per il codice -1 dei valori mancanti
+    lookup = np.fromiter((predicate(c) for c in categorical.cat.categories), dtype=bool,
+                         count=len(categorical.cat.categories))
+    return np.append(lookup, False)[categorical.cat.codes.to_numpy()]
+
+def top_k_indices(values: np.ndarray, k: int) -> np.ndarray:
+    """Indici dei k valori maggiori in ordine decrescente; a parità di valore vince la riga con indice minore,
+    -inf e NaN vanno in coda (come np.argsort(-values, kind='stable')[:k]).
+    Selezione parziale O(n) con np.partition; si ordinano solo i k candidati."""
+    valid = ~np.isnan(values)
+    n_valid = int(valid.sum())
+    k_valid = min(k, n_valid)
+    idx = np.empty(0, dtype=np.intp)
+    if k_valid:
+        threshold = np.partition(values[valid], n_valid - k_valid)[n_valid - k_valid]
+        above = np.flatnonzero(values > threshold)
+        # A parità con la soglia restano le righe con indice minore
+        ties = np.flatnonzero(values == threshold)[:k_valid - len(above)]
+        idx = np.concatenate([above, ties])
+        idx = idx[np.argsort(-values[idx], kind='stable')]
+    return np.concatenate([idx, np.flatnonzero(~valid)[:k - k_valid]])
+
 def get_side_of_field(position: str, heatmap: str) -> Optional[str]:
     """Estrae il lato del campo (L, R) dalla posizione o dalla heatmap. Restituisce 'V' (Verticale/Centrale) se non laterale."""
     if pd.isna(position):
@@ -35,9 +90,9 @@ def get_side_of_field(position: str, heatmap: str) -> Optional[str]:
         
     # 2. Fallback all'Heatmap: Cerca termini laterali (migliorato con regex per 'flank')
     heatmap_lower = heatmap.lower()
-    if re.search(r'(right|destra|rwb?|rb?|right flank)', heatmap_lower):
+    if _SIDE_R_RE.search(heatmap_lower):
         return 'R'
-    if re.search(r'(left|sinistra|lwb?|lb?|left flank)', heatmap_lower):
+    if _SIDE_L_RE.search(heatmap_lower):
         return 'L'
 
     # 3. Ritorno 'V' per Verticale/Centrale (o non specificato)
@@ -62,25 +117,25 @@ def calculate_derived_metrics(df_players: pd.DataFrame) -> pd.DataFrame:
             df[derived] = pd.to_numeric(df[raw], errors='coerce').fillna(0)
     
     # Calcola metriche derivate
-    df['Media_Falli_Fatti_90s_Totale'] = df['Falli_Fatti_Totali'] / df['90s_Giocati_Totali'].replace(0, np.nan)
-    df['Media_Falli_Subiti_90s_Totale'] = df['Falli_Subiti_Totali'] / df['90s_Giocati_Totali'].replace(0, np.nan)
+    # (denominatore nullo -> 0, come il precedente replace + fillna)
+    df['Media_Falli_Fatti_90s_Totale'] = safe_divide(df['Falli_Fatti_Totali'], df['90s_Giocati_Totali'])
+    df['Media_Falli_Subiti_90s_Totale'] = safe_divide(df['Falli_Subiti_Totali'], df['90s_Giocati_Totali'])
     
     # Media 90s per Cartellino Totale (bassa = aggressivo)
-    df['Media_90s_per_Cartellino_Totale'] = df['90s_Giocati_Totali'] / df['Cartellini_Gialli_Totali'].replace(0, np.inf)
+    df['Media_90s_per_Cartellino_Totale'] = safe_divide(df['90s_Giocati_Totali'], df['Cartellini_Gialli_Totali'])
     
     # Media Falli per Cartellino Totale (bassa = propenso ai gialli)
-    df['Media_Falli_per_Cartellino_Totale'] = df['Falli_Fatti_Totali'] / df['Cartellini_Gialli_Totali'].replace(0, np.inf)
+    df['Media_Falli_per_Cartellino_Totale'] = safe_divide(df['Falli_Fatti_Totali'], df['Cartellini_Gialli_Totali'])
     
-    # Ritardo Cartellino (Minuti): Assumi media semplificata se non presente; altrimenti calcola da dati se disponibili
-    # Per demo, genera basato su impulsività (bassa media_90s -> ritardo basso)
-    df['Ritardo_Cartellino_Minuti'] = np.where(
-        df['Media_90s_per_Cartellino_Totale'] < df['Media_90s_per_Cartellino_Totale'].median(),
-        np.random.uniform(20, 60, len(df)),  # Impulsivo: ritardo basso
-        np.random.uniform(60, 120, len(df))  # Calmo: ritardo alto
-    )
+    # Ritardo Cartellino (Minuti): stima deterministica basata su impulsività (bassa media_90s -> ritardo basso)
+    # Rango percentile interpolato: sotto la mediana 20-60 minuti (impulsivo), sopra 60-120 (calmo)
+    impulsivity_rank = df['Media_90s_per_Cartellino_Totale'].rank(pct=True, na_option='bottom').to_numpy()
+    df['Ritardo_Cartellino_Minuti'] = np.interp(impulsivity_rank, [0.0, 0.5, 1.0], [20.0, 60.0, 120.0])
     
     # Gestione NaN/Inf
     df = df.replace([np.inf, -np.inf], np.nan).fillna(0)
+    # Input di rischio senza soglie memorizzati in float32; i calcoli restano in float64
+    df[FLOAT32_METRIC_COLS] = df[FLOAT32_METRIC_COLS].astype(np.float32)
     
     # Mappa Posizione_Primaria da Pos (abbreviazioni comuni)
     position_mapping = {
@@ -104,6 +159,53 @@ def calculate_derived_metrics(df_players: pd.DataFrame) -> pd.DataFrame:
     
     return df
 
+# =========================================================================
+# KERNEL NUMERICI
+# =========================================================================
+
+def _marking_risk_numpy(suffered, committed, marker_strength, p_delay, m_delay, p_role, m_role,
+                        p_side, m_side, eligible, comp_table, denom, threshold):
+    """Rischio di tutti i duelli vittima x marcatore (versione NumPy a matrici).
+    Restituisce (indici vittime, indici marcatori, rischi) dei duelli oltre soglia, in ordine per riga."""
+    comp_score = comp_table[p_role[:, None], m_role[None, :], p_side[:, None], m_side[None, :]]
+    risk = (suffered[:, None] * committed[None, :]) / denom * marker_strength[None, :] * comp_score \
+        * p_delay[:, None] * m_delay[None, :]
+    # Soglia minima di compatibilità 0.5 (esclude 0.3 per Dif Est vs CC) e soglia di rischio
+    i_idx, j_idx = np.nonzero(eligible & (comp_score >= 0.5) & (risk > threshold))
+    return i_idx, j_idx, risk[i_idx, j_idx]
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _marking_risk_kernel(suffered, committed, marker_strength, p_delay, m_delay, p_role, m_role,
+                             p_side, m_side, eligible, comp_table, denom, threshold):
+        """Come _marking_risk_numpy, in un doppio ciclo compilato senza matrici temporanee."""
+        n_p, n_m = suffered.shape[0], committed.shape[0]
+        i_out = np.empty(n_p * n_m, dtype=np.intp)
+        j_out = np.empty(n_p * n_m, dtype=np.intp)
+        risk_out = np.empty(n_p * n_m)
+        count = 0
+        for i in range(n_p):
+            for j in range(n_m):
+                if not eligible[i, j]:
+                    continue
+                comp = comp_table[p_role[i], m_role[j], p_side[i], m_side[j]]
+                if comp < 0.5:
+                    continue
+                risk = (suffered[i] * committed[j]) / denom * marker_strength[j] * comp * p_delay[i] * m_delay[j]
+                if risk > threshold:
+                    i_out[count] = i
+                    j_out[count] = j
+                    risk_out[count] = risk
+                    count += 1
+        return i_out[:count], j_out[:count], risk_out[:count]
+
+    # Compilazione anticipata all'import per evitare la latenza alla prima partita
+    _one, _zero = np.ones(1), np.zeros(1, dtype=np.intp)
+    _marking_risk_kernel(_one, _one, _one, _one, _one, _zero, _zero, _zero, _zero,
+                         np.ones((1, 1), dtype=np.bool_), np.ones((1, 1, 1, 1)), 1.0, 0.0)
+else:
+    _marking_risk_kernel = _marking_risk_numpy
+
 # =========================================================================
 # CLASSE DI PREDIZIONE MIGLIORATA E ROBUSTA
 # =========================================================================
@@ -123,23 +225,22 @@ class AdvancedCardPredictionModel:
         self.compatibility_score_threshold = compatibility_score_threshold
         self.global_referee_avg = global_referee_avg
         
-        self.defensive_roles = ['DF', 'CB', 'LB', 'RB', 'LWB', 'RWB', 'DM']
-        self.central_mid_roles = ['CM', 'DM', 'AM']
-        self.global_medians = {}  # Verranno calcolati in calculate_match_risk
+        self.defensive_roles = frozenset(['DF', 'CB', 'LB', 'RB', 'LWB', 'RWB', 'DM'])
+        self.central_mid_roles = frozenset(['CM', 'DM', 'AM'])
+        self.global_medians = None  # GlobalMedians, calcolate in calculate_match_risk
+        self._comp_table, self._comp_detail = self._build_compatibility_table()
 
     def _calculate_team_and_global_averages(self, df_players: pd.DataFrame, df_referees: pd.DataFrame) -> Dict:
         """Calcola medie globali, per squadra e per arbitro."""
-        # Medie globali giocatori
-        self.global_medians = {
-            'fouls_suffered_90s': df_players['Media_Falli_Subiti_90s_Totale'].median(),
-            'fouls_committed_90s': df_players['Media_Falli_Fatti_90s_Totale'].median(),
-            'games_per_card': df_players['Media_90s_per_Cartellino_Totale'].median(),
-            'fouls_per_card': df_players['Media_Falli_per_Cartellino_Totale'].median(),
-            'card_delay': df_players['Ritardo_Cartellino_Minuti'].median()
-        }
+        # Medie globali giocatori: un solo blocco NumPy, mediane per colonna in un passaggio (NaN ignorati)
+        medians = np.nanmedian(df_players[[
+            'Media_Falli_Subiti_90s_Totale', 'Media_Falli_Fatti_90s_Totale', 'Media_90s_per_Cartellino_Totale',
+            'Media_Falli_per_Cartellino_Totale', 'Ritardo_Cartellino_Minuti'
+        ]].to_numpy(dtype=np.float64), axis=0)
+        self.global_medians = GlobalMedians._make(medians.tolist())
         
-        # Medie per squadra (cartellini totali / partite ~34 per stagione)
-        df_players['Squadra_Avg_Cards'] = df_players.groupby('Squadra')['Cartellini_Gialli_Totali'].transform('mean') / 34.0
+        # Medie per squadra (cartellini totali / partite ~34 per stagione): un solo groupby
+        team_means = df_players.groupby('Squadra')['Cartellini_Gialli_Totali'].mean() / 34.0
         
         # Medie arbitri
         avg_referee_cards = df_referees['Gialli ap (Media/Partita)'].mean() if 'Gialli ap (Media/Partita)' in df_referees.columns else self.global_referee_avg
@@ -147,53 +248,60 @@ class AdvancedCardPredictionModel:
         return {
             'global_medians': self.global_medians,
             'avg_referee_cards': avg_referee_cards,
-            'team_avg_cards': df_players.groupby('Squadra')['Squadra_Avg_Cards'].first().to_dict()
+            'team_avg_cards': team_means.to_dict(),
+            # Stesse medie come array indicizzato dal codice squadra (categorie = team_names);
+            # l'ultimo elemento è il fallback (0) per il codice -1 delle squadre sconosciute
+            'team_names': team_means.index,
+            'team_avg_arr': np.append(np.nan_to_num(team_means.to_numpy(dtype=np.float64)), 0.0)
         }
 
-    def _calculate_statistical_risk(self, row, referee_factor: float, averages: Dict) -> float:
-        """Calcola rischio statistico base, integrando deviazioni dalle medie."""
+    def _calculate_statistical_risk_vec(self, df: pd.DataFrame, referee_factor: float, averages: Dict) -> np.ndarray:
+        """Calcola rischio statistico base per tutti i giocatori, integrando deviazioni dalle medie."""
+        gm = averages['global_medians']
+        # Input in parte float32, calcolo in float64: con la guardia 1e-6 i termini arrivano a ~1e6 e la precisione
+        # float32 (passo ~0.06) confonderebbe i giocatori ai vertici della classifica
+        
         # Base: falli fatti/subiti
-        fouls_risk = (row['Media_Falli_Fatti_90s_Totale'] / averages['global_medians']['fouls_committed_90s']) * 0.4
-        suffered_risk = (row['Media_Falli_Subiti_90s_Totale'] / averages['global_medians']['fouls_suffered_90s']) * 0.3
+        fouls_risk = (df['Media_Falli_Fatti_90s_Totale'].to_numpy(dtype=np.float64) / gm.fouls_committed_90s) * 0.4
+        suffered_risk = (df['Media_Falli_Subiti_90s_Totale'].to_numpy(dtype=np.float64) / gm.fouls_suffered_90s) * 0.3
         
         # Aggressività: inverso media partite/cartellino (bassa = alto rischio)
-        games_per_card_safe = max(row['Media_90s_per_Cartellino_Totale'], 1e-6)
-        agg_risk = (averages['global_medians']['games_per_card'] / games_per_card_safe) * 0.2
+        games_per_card_safe = np.maximum(df['Media_90s_per_Cartellino_Totale'].to_numpy(dtype=np.float64), 1e-6)
+        agg_risk = (gm.games_per_card / games_per_card_safe) * 0.2
         
         # Propensione: inverso falli/cartellino (bassa = propenso)
-        fouls_per_card_safe = max(row['Media_Falli_per_Cartellino_Totale'], 1e-6)
-        prop_risk = (averages['global_medians']['fouls_per_card'] / fouls_per_card_safe) * 0.2
+        fouls_per_card_safe = np.maximum(df['Media_Falli_per_Cartellino_Totale'].to_numpy(dtype=np.float64), 1e-6)
+        prop_risk = (gm.fouls_per_card / fouls_per_card_safe) * 0.2
         
         # Deviazione dalla media squadra
-        team_dev = abs(row.get('Squadra_Avg_Cards', 0) - averages['team_avg_cards'].get(row['Squadra'], 0))
-        team_risk = min(team_dev * 0.1, 0.5)  # Penalizza deviazioni alte
+        own_avg = df['Squadra_Avg_Cards'].to_numpy(dtype=np.float64) if 'Squadra_Avg_Cards' in df.columns else np.zeros(len(df))
+        team_codes = pd.Categorical(df['Squadra'], categories=averages['team_names']).codes
+        team_avg = averages['team_avg_arr'][team_codes]
+        team_risk = np.minimum(np.abs(own_avg - team_avg) * 0.1, 0.5)  # Penalizza deviazioni alte
         
         risk = fouls_risk + suffered_risk + agg_risk + prop_risk + team_risk
         return risk * referee_factor
 
-    def _calculate_delay_factor(self, row: pd.Series, global_medians: Dict) -> float:
+    def _delay_factor_vec(self, df: pd.DataFrame, global_medians: GlobalMedians) -> np.ndarray:
         """Fattore ritardo: applicato SOLO a giocatori con media partite/cartellino bassa (tendenti al cartellino).
         Se media_90s_per_cartellino < mediana globale, allora:
-        - Se ritardo < threshold (basato su media partite), aumenta rischio (impulsivo).
+        - Se ritardo > threshold (basato su media partite), riduce rischio (0.7, calmo).
+        - Se ritardo basso rispetto alla mediana globale, aumenta rischio (1.3, impulsivo).
         Altrimenti, fattore neutro (1.0)."""
-        games_per_card = row['Media_90s_per_Cartellino_Totale']
-        global_games_per_card = global_medians['games_per_card']
+        games_per_card = df['Media_90s_per_Cartellino_Totale'].to_numpy(dtype=np.float64)
+        delay = df['Ritardo_Cartellino_Minuti'].to_numpy(dtype=np.float64)
         
         # Applica solo a tendenti (bassa media partite/cartellino)
-        if games_per_card >= global_games_per_card:
-            return 1.0  # Neutro per giocatori calmi/non tendenti
-        
-        # Per tendenti: calcola threshold e factor
-        delay = row['Ritardo_Cartellino_Minuti']
-        threshold = games_per_card * 30  # Es. se 5 partite/cartellino, threshold ~150 min
+        tending = ~(games_per_card >= global_medians.games_per_card)
+        # Threshold: es. se 5 partite/cartellino, threshold ~150 min
+        calm = delay > games_per_card * 30
+        impulsive = delay < global_medians.card_delay * 0.8
         
-        if delay > threshold:
-            return 0.7  # Calmo nonostante tendenza, riduci rischio
-        elif delay < global_medians['card_delay'] * 0.8:  # Impulsivo (basso ritardo)
-            return 1.3  # Aumenta rischio
-        return 1.0  # Neutro
+        return np.where(tending & calm, 0.7, np.where(tending & impulsive, 1.3, 1.0))
 
-    def _get_role_category(self, pos: str) -> Tuple[str, str]:
+    @staticmethod
+    @lru_cache(maxsize=None)  # Poche decine di posizioni distinte in tutto il campionato
+    def _get_role_category(pos: str) -> Tuple[str, str]:
         """Categorizza ruolo per compatibilità: (main, side) es. ('Defender', 'Flank') per LB/RB, ('Central_Mid', 'Central') per CM."""
         pos_upper = pos.upper()
         is_flank = any(side in pos_upper for side in ['LB', 'RB', 'LW', 'RW', 'LWB', 'RWB'])
@@ -219,7 +327,13 @@ class AdvancedCardPredictionModel:
         - Altri: 0.5"""
         player_main, player_sub = self._get_role_category(player_pos)
         marker_main, marker_sub = self._get_role_category(marker_pos)
-        
+        return self._compatibility_by_category(player_main, player_sub, marker_main, marker_sub, player_side, marker_side)
+
+    @staticmethod
+    @lru_cache(maxsize=None)  # Dominio finito: 5 x 2 x 5 x 2 categorie x 3 x 3 lati
+    def _compatibility_by_category(player_main: str, player_sub: str, marker_main: str, marker_sub: str,
+                                   player_side: str, marker_side: str) -> Tuple[float, str]:
+        """Regole di _calculate_compatibility_score applicate a categorie di ruolo già calcolate."""
         # CC vs CC
         if player_main == 'Central_Mid' and marker_main == 'Central_Mid':
             return 1.0, 'CC vs CC'
@@ -263,61 +377,112 @@ class AdvancedCardPredictionModel:
         # Default basso
         return 0.5, 'Bassa Compatibilità'
 
+    def _build_compatibility_table(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Tabelle (score, dettaglio) indicizzate da [ruolo vittima, ruolo marcatore, lato vittima, lato marcatore],
+        con ruolo = categoria * 2 + sottocategoria; riempite una volta dalle regole di compatibilità."""
+        n_roles = len(ROLE_MAINS) * len(ROLE_SUBS)
+        shape = (n_roles, n_roles, len(SIDES), len(SIDES))
+        scores = np.empty(shape)
+        details = np.empty(shape, dtype=object)
+        roles = [(main, sub) for main in ROLE_MAINS for sub in ROLE_SUBS]
+        for p_code, (p_main, p_sub) in enumerate(roles):
+            for m_code, (m_main, m_sub) in enumerate(roles):
+                for p_side_code, p_side in enumerate(SIDES):
+                    for m_side_code, m_side in enumerate(SIDES):
+                        scores[p_code, m_code, p_side_code, m_side_code], details[p_code, m_code, p_side_code, m_side_code] = \
+                            self._compatibility_by_category(p_main, p_sub, m_main, m_sub, p_side, m_side)
+        return scores, details
+
+    def _encode_roles(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """Codici interi di ruolo (categoria * 2 + sottocategoria) e lato (0=L, 1=R, 2=V) per ogni giocatore."""
+        positions = df['Posizione_Primaria']
+        role_by_pos = {}
+        for pos in positions.unique():
+            main, sub = self._get_role_category(pos)
+            role_by_pos[pos] = _ROLE_MAIN_CODE[main] * len(ROLE_SUBS) + _ROLE_SUB_CODE[sub]
+        role_code = positions.map(role_by_pos).to_numpy(dtype=np.intp)
+        # Lato calcolato una sola volta per coppia distinta (posizione, heatmap)
+        pairs = list(zip(positions.to_numpy(), df['Heatmap'].to_numpy()))
+        side_by_pair = {pair: _SIDE_CODE[get_side_of_field(*pair)] for pair in set(pairs)}
+        side_code = np.fromiter((side_by_pair[pair] for pair in pairs), dtype=np.intp, count=len(pairs))
+        return role_code, side_code
+
     def identify_critical_marking_situations(self, home_data: pd.DataFrame, away_data: pd.DataFrame, averages: Dict) -> List[Dict]:
         """Identifica marcature critiche: top falli subiti vs potenziali marcatori aggressivi.
-        Usa score di compatibilità per pesare i duelli (non mostra dettagli, solo per elaborazione)."""
+        Usa score di compatibilità per pesare i duelli (non mostra dettagli, solo per elaborazione).
+        Tutti i duelli vittima x marcatore di una squadra sono valutati insieme come matrici (vittime, marcatori)."""
         critical_situations = []
+        gm = averages['global_medians']
         
         # Seleziona top 20% falli subiti per squadra (giocatori "vittime")
         for team_data, is_home in [(home_data, True), (away_data, False)]:
-            high_sufferers = team_data[
-                team_data['Media_Falli_Subiti_90s_Totale'] >= team_data['Media_Falli_Subiti_90s_Totale'].quantile(0.8)
-            ]
+            suffered = team_data['Media_Falli_Subiti_90s_Totale']
+            high_sufferers = team_data[suffered >= suffered.quantile(0.8)]
             
             opponent_data = away_data if is_home else home_data
             
-            for _, player in high_sufferers.iterrows():
-                player_side = get_side_of_field(player['Posizione_Primaria'], player['Heatmap'])
-                
-                # Potenziali marcatori: top aggressivi in ruoli complementari
-                potential_markers = opponent_data[
-                    (opponent_data['Media_Falli_Fatti_90s_Totale'] >= self.marking_threshold_fouls_committed) &
-                    (opponent_data['Posizione_Primaria'].isin(self.defensive_roles) if 'FW' in player['Posizione_Primaria'] else True)
-                ]
-                
-                for _, marker in potential_markers.iterrows():
-                    marker_side = get_side_of_field(marker['Posizione_Primaria'], marker['Heatmap'])
-                    comp_score, detail = self._calculate_compatibility_score(player['Posizione_Primaria'], marker['Posizione_Primaria'], player_side, marker_side)
-                    
-                    if comp_score >= 0.5:  # Soglia minima per considerare duello (esclude 0.3 per Dif Est vs CC)
-                        # Score matchup pesato dalla compatibilità
-                        base_matchup = (player['Media_Falli_Subiti_90s_Totale'] * marker['Media_Falli_Fatti_90s_Totale']) / (averages['global_medians']['fouls_suffered_90s'] * averages['global_medians']['fouls_committed_90s'])
-                        
-                        # Fattori aggressività marcatori
-                        marker_agg = (averages['global_medians']['games_per_card'] / max(marker['Media_90s_per_Cartellino_Totale'], 1e-6)) * 0.2
-                        marker_prop = (averages['global_medians']['fouls_per_card'] / max(marker['Media_Falli_per_Cartellino_Totale'], 1e-6)) * 0.2
-                        
-                        # Usa comp_score invece di bonus fisso
-                        
-                        # Delay factor per entrambi (solo se tendenti)
-                        player_delay_factor = self._calculate_delay_factor(player, averages['global_medians'])
-                        marker_delay_factor = self._calculate_delay_factor(marker, averages['global_medians'])
-                        
-                        situation_risk = base_matchup * (marker_agg + marker_prop) * comp_score * player_delay_factor * marker_delay_factor
-                        
-                        if situation_risk > self.compatibility_score_threshold:
-                            critical_situations.append({
-                                'Player': player['Player'],
-                                'Team': player['Squadra'],
-                                'Marker': marker['Player'],
-                                'Marker_Team': marker['Squadra'],
-                                'Player_Side': player_side,
-                                'Marker_Side': marker_side,
-                                'Compatibility_Score': comp_score,
-                                'Compatibility_Detail': detail,  # Interno, non mostrato
-                                'Situation_Risk': situation_risk,
-                                'Matchup_Type': 'Victim vs Aggressor'
-                            })
+            # Potenziali marcatori: aggressivi dell'avversario (il filtro per ruolo dipende dalla vittima)
+            markers = opponent_data[opponent_data['Media_Falli_Fatti_90s_Totale'] >= self.marking_threshold_fouls_committed]
+            if high_sufferers.empty or markers.empty:
+                continue
+            
+            # Vittime attaccanti: solo marcatori in ruoli difensivi (maschere calcolate una volta per squadra)
+            p_forward = category_mask(high_sufferers['Posizione_Primaria'], lambda pos: 'FW' in pos)
+            m_defensive = category_mask(markers['Posizione_Primaria'], self.defensive_roles.__contains__)
+            eligible = ~p_forward[:, None] | m_defensive[None, :]
+            
+            # Codici ruolo/lato per la tabella di compatibilità
+            p_role, p_side = self._encode_roles(high_sufferers)
+            m_role, m_side = self._encode_roles(markers)
+            
+            # Fattori aggressività marcatori
+            marker_agg = (gm.games_per_card / np.maximum(markers['Media_90s_per_Cartellino_Totale'].to_numpy(dtype=np.float64), 1e-6)) * 0.2
+            marker_prop = (gm.fouls_per_card / np.maximum(markers['Media_Falli_per_Cartellino_Totale'].to_numpy(dtype=np.float64), 1e-6)) * 0.2
+            
+            suffered_arr = high_sufferers['Media_Falli_Subiti_90s_Totale'].to_numpy(dtype=np.float64)
+            committed_arr = markers['Media_Falli_Fatti_90s_Totale'].to_numpy(dtype=np.float64)
+            marker_strength = marker_agg + marker_prop
+            p_delay = self._delay_factor_vec(high_sufferers, gm)
+            m_delay = self._delay_factor_vec(markers, gm)
+            denom = float(gm.fouls_suffered_90s * gm.fouls_committed_90s)
+            threshold = float(self.compatibility_score_threshold)
+            
+            # Potatura: limite superiore del rischio per vittima e per marcatore (compatibilità massima);
+            # si scartano prima della matrice le righe/colonne che non possono superare la soglia.
+            # Margine relativo contro l'arrotondamento; i NaN non vengono mai scartati.
+            p_bound = suffered_arr * p_delay / denom
+            m_bound = committed_arr * marker_strength * m_delay * self._comp_table.max() * (1 + 1e-9)
+            p_keep = np.flatnonzero(~(p_bound * m_bound.max() <= threshold))
+            m_keep = np.flatnonzero(~(m_bound * p_bound.max() <= threshold))
+            if len(p_keep) == 0 or len(m_keep) == 0:
+                continue
+            
+            # Score matchup pesato dalla compatibilità e dai delay factor (solo se tendenti), solo duelli oltre soglia
+            i_sub, j_sub, situation_risk = _marking_risk_kernel(
+                suffered_arr[p_keep], committed_arr[m_keep], marker_strength[m_keep],
+                p_delay[p_keep], m_delay[m_keep],
+                p_role[p_keep], m_role[m_keep], p_side[p_keep], m_side[m_keep],
+                eligible[np.ix_(p_keep, m_keep)],
+                self._comp_table, denom, threshold
+            )
+            # Indici della sottomatrice riportati alle righe originali (ordine per riga invariato)
+            i_idx, j_idx = p_keep[i_sub], m_keep[j_sub]
+            
+            p_names, p_teams = high_sufferers['Player'].to_numpy(), high_sufferers['Squadra'].to_numpy()
+            m_names, m_teams = markers['Player'].to_numpy(), markers['Squadra'].to_numpy()
+            for i, j, risk in zip(i_idx, j_idx, situation_risk):
+                critical_situations.append({
+                    'Player': p_names[i],
+                    'Team': p_teams[i],
+                    'Marker': m_names[j],
+                    'Marker_Team': m_teams[j],
+                    'Player_Side': SIDES[p_side[i]],
+                    'Marker_Side': SIDES[m_side[j]],
+                    'Compatibility_Score': self._comp_table[p_role[i], m_role[j], p_side[i], m_side[j]],
+                    'Compatibility_Detail': self._comp_detail[p_role[i], m_role[j], p_side[i], m_side[j]],  # Interno, non mostrato
+                    'Situation_Risk': risk,
+                    'Matchup_Type': 'Victim vs Aggressor'
+                })
         
         return critical_situations
 
@@ -326,10 +491,15 @@ class AdvancedCardPredictionModel:
         # Preprocess dati
         home_data = calculate_derived_metrics(home_data)
         away_data = calculate_derived_metrics(away_data)
-        df_match = pd.concat([home_data, away_data], ignore_index=True)
         
-        # Calcola medie
-        averages = self._calculate_team_and_global_averages(df_match, referee_data)
+        # Calcola medie su una concatenazione temporanea delle sole colonne necessarie (non conservata)
+        avg_cols = [
+            'Squadra', 'Cartellini_Gialli_Totali', 'Media_Falli_Subiti_90s_Totale', 'Media_Falli_Fatti_90s_Totale',
+            'Media_90s_per_Cartellino_Totale', 'Media_Falli_per_Cartellino_Totale', 'Ritardo_Cartellino_Minuti'
+        ]
+        averages = self._calculate_team_and_global_averages(
+            pd.concat([home_data[avg_cols], away_data[avg_cols]], ignore_index=True), referee_data
+        )
         
         # Fattore arbitro specifico vs globali
         referee_factor = 1.0
@@ -337,43 +507,48 @@ class AdvancedCardPredictionModel:
             ref_yellows = referee_data['Gialli ap (Media/Partita)'].iloc[0] if 'Gialli ap (Media/Partita)' in referee_data.columns else 4.0
             referee_factor = ref_yellows / averages['avg_referee_cards']
         
-        # Rischio statistico base per tutti
-        df_match['Rischio_Statistico'] = df_match.apply(
-            lambda row: self._calculate_statistical_risk(row, referee_factor, averages), axis=1
-        )
-        
-        # Identifica situazioni critiche (duelli interni)
-        critical_situations = self.identify_critical_marking_situations(home_data, away_data, averages)
+        # Mediane globali nulle producono nan/inf nei rapporti: errori numerici silenziati solo qui
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Rischio statistico base e fattore ritardo: locali alla riga, calcolati per squadra
+            for team_data in (home_data, away_data):
+                team_data['Squadra_Avg_Cards'] = team_data['Squadra'].map(averages['team_avg_cards'])
+                team_data['Rischio_Statistico'] = self._calculate_statistical_risk_vec(team_data, referee_factor, averages)
+                team_data['Delay_Factor'] = self._delay_factor_vec(team_data, averages['global_medians'])
+            
+            # Identifica situazioni critiche (duelli interni)
+            critical_situations = self.identify_critical_marking_situations(home_data, away_data, averages)
         
         # Aggrega rischi critici per giocatore (max per ruolo vittima/marcatore)
-        player_risks = df_match[['Player', 'Squadra', 'Rischio_Statistico']].copy()
+        # Unione casa/trasferta solo qui, sulle poche colonne di output
+        risk_cols = ['Player', 'Squadra', 'Rischio_Statistico', 'Delay_Factor']
+        player_risks = pd.concat([home_data[risk_cols], away_data[risk_cols]], ignore_index=True)
         if critical_situations:
             crit_df = pd.DataFrame(critical_situations)
-            # Rischio max come vittima
-            victim_risk = crit_df.groupby(['Player', 'Team'])['Situation_Risk'].max().reset_index(name='Rischio_Vittima')
-            # Rischio max come marcatore
-            marker_risk = crit_df.groupby(['Marker', 'Marker_Team'])['Situation_Risk'].max().reset_index(name='Rischio_Marcatore')
-            marker_risk.rename(columns={'Marker': 'Player', 'Marker_Team': 'Squadra'}, inplace=True)
-            
-            # Merge e max
-            crit_risk = pd.merge(victim_risk, marker_risk, on=['Player', 'Squadra'], how='outer').fillna(0)
-            crit_risk['Rischio_Critico'] = crit_risk[['Rischio_Vittima', 'Rischio_Marcatore']].max(axis=1)
+            # Formato lungo (giocatore, squadra, rischio) con i duelli sia da vittima sia da marcatore:
+            # un solo groupby dà il rischio critico massimo per giocatore
+            long_risk = pd.concat([
+                crit_df[['Player', 'Team', 'Situation_Risk']].set_axis(['Player', 'Squadra', 'Situation_Risk'], axis=1),
+                crit_df[['Marker', 'Marker_Team', 'Situation_Risk']].set_axis(['Player', 'Squadra', 'Situation_Risk'], axis=1)
+            ], ignore_index=True)
+            crit_risk = long_risk.groupby(['Player', 'Squadra'], sort=False)['Situation_Risk'].max()
             
-            player_risks = pd.merge(player_risks, crit_risk[['Player', 'Squadra', 'Rischio_Critico']], on=['Player', 'Squadra'], how='left').fillna(0)
+            # Allineamento per indice (Player, Squadra) al posto del merge; 0 per chi non ha duelli critici
+            player_keys = pd.MultiIndex.from_frame(player_risks[['Player', 'Squadra']])
+            player_risks['Rischio_Critico'] = crit_risk.reindex(player_keys).fillna(0).to_numpy()
+            player_risks['Rischio_Statistico'] = player_risks['Rischio_Statistico'].fillna(0)
             
             # Rischio finale: 60% critico se presente, else 100% statistico + delay factor (solo per tendenti)
-            player_risks['Delay_Factor'] = player_risks.apply(lambda row: self._calculate_delay_factor(row, averages['global_medians']), axis=1)
             player_risks['Rischio_Finale'] = np.where(
                 player_risks['Rischio_Critico'] > 0,
                 (player_risks['Rischio_Statistico'] * 0.4 + player_risks['Rischio_Critico'] * 0.6) * player_risks['Delay_Factor'],
                 player_risks['Rischio_Statistico'] * player_risks['Delay_Factor']
             )
         else:
-            player_risks['Delay_Factor'] = player_risks.apply(lambda row: self._calculate_delay_factor(row, averages['global_medians']), axis=1)
             player_risks['Rischio_Finale'] = player_risks['Rischio_Statistico'] * player_risks['Delay_Factor']
         
         # Top 4 predizioni
-        top_4 = player_risks.nlargest(4, 'Rischio_Finale')[['Player', 'Squadra', 'Rischio_Finale']].to_dict('records')
+        idx = top_k_indices(player_risks['Rischio_Finale'].to_numpy(dtype=np.float64), 4)
+        top_4 = player_risks.iloc[idx][['Player', 'Squadra', 'Rischio_Finale']].to_dict('records')
         
         return {
             'top_4_predictions': top_4,
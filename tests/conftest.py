@@ -0,0 +1,35 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+# I moduli del progetto stanno nella radice del repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def _team(name: str) -> pd.DataFrame:
+    return pd.DataFrame({
+        'Player': [f'{name} A', f'{name} B'],
+        'Squadra': [name, name],
+        'Posizione_Primaria': ['DF', 'MF'],
+        'Heatmap': ['back', 'attack'],
+        'Media Falli Fatti 90s Totale': [1.5, 2.0],
+        'Media Falli Subiti 90s Totale': [1.0, 1.2],
+        'Media Falli per Cartellino Totale': [6.0, 4.0],
+        'Media 90s per Cartellino Totale': [5.0, 3.0],
+        'Cartellini Gialli Totali': [3, 5],
+        '90s Giocati Totali': [15.0, 15.0],
+    })
+
+
+@pytest.fixture
+def make_team():
+    """Rosa minima di due giocatori con tutte le colonne lette dai modelli."""
+    return _team
+
+
+@pytest.fixture
+def referees() -> pd.DataFrame:
+    """Due arbitri: il primo permissivo, il secondo severo (i modelli leggono la riga 0)."""
+    return pd.DataFrame({'Nome': ['Rossi', 'Bianchi'], 'Gialli a partita': [3.0, 5.5]})
@@ -0,0 +1,91 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from app import (
+    NUMBA_AVAILABLE, ROLE_BONUS_LUT, SuperAdvancedCardPredictionModel, _advanced_risk_kernel,
+    _advanced_risk_numpy, _matchup_bonus_kernel, _matchup_bonus_numpy
+)
+from optimized_prediction_model import OptimizedCardPredictionModel
+
+
+@pytest.mark.parametrize('model_cls', [OptimizedCardPredictionModel, SuperAdvancedCardPredictionModel])
+def test_cached_prediction_not_reused_for_reordered_referee_rows(model_cls, make_team, referees):
+    home, away = make_team('Casa'), make_team('Ospiti')
+    reordered = referees.iloc[::-1].reset_index(drop=True)
+
+    model = model_cls()
+    first = model.predict_match_cards(home, away, referees)
+    second = model.predict_match_cards(home, away, reordered)
+
+    assert first['referee_profile']['Nome'] == 'Rossi'
+    assert first['referee_profile']['Severity'] == 'permissive'
+    assert second['referee_profile']['Nome'] == 'Bianchi'
+    assert second['referee_profile']['Severity'] == 'strict'
+
+
+@pytest.mark.parametrize('model_cls', [OptimizedCardPredictionModel, SuperAdvancedCardPredictionModel])
+def test_prediction_result_behaves_like_the_old_dict(model_cls, make_team, referees):
+    result = model_cls().predict_match_cards(make_team('Casa'), make_team('Ospiti'), referees)
+    as_dict = dict(result)
+
+    assert list(result) == list(result.keys()) == list(as_dict)
+    assert len(result) == len(as_dict)
+    assert [key for key, _ in result.items()] == list(as_dict)
+    assert result.values()[0] is result['match_info']
+    assert as_dict['all_predictions'] is result['all_predictions']
+
+
+@pytest.mark.parametrize('model_cls', [OptimizedCardPredictionModel, SuperAdvancedCardPredictionModel])
+def test_instance_weights_change_risk(model_cls, make_team, referees):
+    home, away = make_team('Casa'), make_team('Ospiti')
+    weights = dict(model_cls().weights, Falli_Fatti=0.9)
+
+    default = model_cls().predict_match_cards(home, away, referees)
+    custom = model_cls(weights).predict_match_cards(home, away, referees)
+
+    assert custom['algorithm_summary']['weights_used'] == weights
+    assert not np.allclose(custom.risk, default.risk)
+
+
+def test_advanced_prediction_emits_no_warnings(make_team, referees):
+    # app.py silenzia i warning all'import: qui tornano errori (es. SettingWithCopyWarning su pandas 2)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        SuperAdvancedCardPredictionModel().predict_match_cards(make_team('Casa'), make_team('Ospiti'), referees)
+
+
+@pytest.mark.skipif(not NUMBA_AVAILABLE, reason='numba non installato: il kernel è già la versione NumPy')
+@pytest.mark.parametrize('seed', range(20))
+def test_advanced_risk_kernel_matches_numpy(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 30))
+    groups = rng.integers(0, 2, n).astype(np.int8)
+    args = (
+        rng.random(n),
+        rng.choice([0.0, 2.0, 4.5, 8.0], n).astype(np.float32),
+        rng.choice([0.0, 1.5, 5.0, 12.0], n).astype(np.float32),
+        rng.random(n),
+        rng.choice([0.0, 0.10, 0.15], n).astype(np.float32),
+        rng.integers(-1, 4, n).astype(np.int8),
+        ROLE_BONUS_LUT,
+        SuperAdvancedCardPredictionModel()._advanced_w,
+        6.0, 5.0, groups, int(groups.max()) + 1,
+    )
+    # Gli input float32 sono combinati in float32 da NumPy e in float64 dal ciclo compilato
+    risk, comps = _advanced_risk_kernel(*args)
+    expected_risk, expected_comps = _advanced_risk_numpy(*args)
+    np.testing.assert_allclose(risk, expected_risk, rtol=1e-6, atol=1e-9)
+    np.testing.assert_allclose(comps, expected_comps, rtol=1e-6, atol=1e-9)
+
+
+@pytest.mark.skipif(not NUMBA_AVAILABLE, reason='numba non installato: il kernel è già la versione NumPy')
+@pytest.mark.parametrize('opp_att_victim', [False, True])
+@pytest.mark.parametrize('opp_mid_victim', [False, True])
+def test_matchup_bonus_kernel_matches_numpy(opp_att_victim, opp_mid_victim):
+    rng = np.random.default_rng(0)
+    codes = rng.integers(-1, 4, 40).astype(np.int8)
+    agg, mid = rng.random(40) < 0.5, rng.random(40) < 0.5
+    args = (codes, agg, mid, opp_att_victim, opp_mid_victim)
+    np.testing.assert_array_equal(_matchup_bonus_kernel(*args), _matchup_bonus_numpy(*args))
@@ -0,0 +1,58 @@
+import io
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+
+import data_processor
+from data_processor import DataProcessor, _prune_excel_cache
+
+
+def test_prune_excel_cache_keeps_most_recent_files(tmp_path):
+    for i in range(5):
+        path = tmp_path / f'{i}.parquet'
+        path.write_bytes(b'')
+        os.utime(path, (i, i))
+    (tmp_path / 'other.txt').write_bytes(b'')
+
+    _prune_excel_cache(tmp_path, 2)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['3.parquet', '4.parquet', 'other.txt']
+
+
+def test_read_excel_without_cache_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_processor, 'EXCEL_CACHE_DIR', tmp_path)
+    monkeypatch.setattr(pd, 'read_excel', lambda buffer: pd.DataFrame({'Nome': ['Rossi']}))
+
+    df = DataProcessor(excel_cache=False)._read_excel_cached(io.BytesIO(b'xlsx'))
+
+    assert df['Nome'].tolist() == ['Rossi']
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_read_excel_cache_write_hit_and_corrupt_fallback(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(data_processor, 'EXCEL_CACHE_DIR', tmp_path)
+    parsed = []
+    def read_excel(buffer):
+        parsed.append(buffer)
+        return pd.DataFrame({'Nome': ['Rossi'], 'Età': [30]})
+    monkeypatch.setattr(pd, 'read_excel', read_excel)
+    processor = DataProcessor(excel_cache=True)
+
+    first = processor._read_excel_cached(io.BytesIO(b'xlsx'))
+    (cache_file,) = tmp_path.iterdir()
+    assert cache_file.suffix == '.parquet' and len(parsed) == 1
+
+    # Stesso contenuto: letto dalla copia Parquet senza rileggere l'Excel
+    pd.testing.assert_frame_equal(processor._read_excel_cached(io.BytesIO(b'xlsx')), first)
+    assert len(parsed) == 1
+
+    # Copia illeggibile: si rilegge l'Excel e la copia viene riscritta
+    cache_file.write_bytes(b'non parquet')
+    pd.testing.assert_frame_equal(processor._read_excel_cached(io.BytesIO(b'xlsx')), first)
+    assert len(parsed) == 2
+    assert [p.name for p in tmp_path.iterdir()] == [cache_file.name]
+    pd.testing.assert_frame_equal(pd.read_parquet(cache_file), first)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from optimized_prediction_model import (
+    NUMBA_AVAILABLE, OptimizedCardPredictionModel, _risk_kernel, _risk_kernel_numpy, frame_key, get_field_zone,
+    get_player_role, get_referee_severity, map_field_zones, map_player_roles
+)
+
+
+def test_frame_key_depends_on_row_order():
+    df = pd.DataFrame({'Nome': ['Rossi', 'Bianchi'], 'Gialli a partita': [3.0, 5.5]})
+    assert frame_key(df) == frame_key(df.copy())
+    assert frame_key(df) != frame_key(df.iloc[::-1].reset_index(drop=True))
+
+
+def test_tied_predictions_keep_home_then_away_input_order(make_team, referees):
+    def tied_team(name):
+        # Due profili alternati: A1, B1, A2, B2 (stesso rischio a parità di profilo)
+        team = make_team(name).iloc[[0, 1, 0, 1]].reset_index(drop=True)
+        team['Player'] = [f'{name} A1', f'{name} B1', f'{name} A2', f'{name} B2']
+        return team
+
+    result = OptimizedCardPredictionModel().predict_match_cards(tied_team('Casa'), tied_team('Ospiti'), referees)
+    ranked = result['all_predictions']
+
+    assert ranked['Rischio'].nunique() == 2
+    assert ranked['Player'].tolist() == [
+        'Casa B1', 'Casa B2', 'Ospiti B1', 'Ospiti B2', 'Casa A1', 'Casa A2', 'Ospiti A1', 'Ospiti A2'
+    ]
+
+
+def test_referee_severity_boundaries_and_missing_average():
+    assert get_referee_severity(3.79) == 'permissive'
+    assert get_referee_severity(3.8) == 'medium'
+    assert get_referee_severity(4.8) == 'medium'
+    assert get_referee_severity(4.81) == 'strict'
+    assert get_referee_severity(np.nan) == 'medium'
+    assert list(get_referee_severity(np.array([3.0, 3.8, 4.8, 5.0, np.nan]))) == [
+        'permissive', 'medium', 'medium', 'strict', 'medium'
+    ]
+
+
+def test_map_field_zones_handles_mixed_missing_values():
+    heatmaps = pd.Series(['attack', np.nan, None, 'back', 'attack'], dtype=object)
+    assert map_field_zones(heatmaps).tolist() == ['attack', 'midfield', 'midfield', 'defense', 'attack']
+    pd.testing.assert_series_equal(map_field_zones(heatmaps), heatmaps.apply(get_field_zone))
+
+
+def test_map_player_roles_matches_per_row_apply():
+    positions = pd.Series(['DF', 'MF', 'FW', 'XX', np.nan, 'DF', 'CB,DM'], index=range(10, 17))
+    mapped = map_player_roles(positions)
+    pd.testing.assert_series_equal(mapped, positions.apply(get_player_role))
+    assert map_field_zones(pd.Series([], dtype=object)).tolist() == []
+
+
+@pytest.mark.skipif(not NUMBA_AVAILABLE, reason='numba non installato: il kernel è già la versione NumPy')
+@pytest.mark.parametrize('n', [0, 1, 7, 50])
+def test_risk_kernel_matches_numpy(n):
+    rng = np.random.default_rng(n)
+    factors = [rng.uniform(0, 3, n) for _ in range(5)]
+    w = np.array([0.35, 0.125, 0.1, 0.1, 0.1])
+    np.testing.assert_allclose(_risk_kernel(*factors, w), _risk_kernel_numpy(*factors, w), rtol=1e-9)
+    zeros = [np.zeros(n) for _ in range(5)]
+    np.testing.assert_array_equal(_risk_kernel(*zeros, w), _risk_kernel_numpy(*zeros, w))
@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from prediction_model import (
+    NUMBA_AVAILABLE, ROLE_MAINS, ROLE_SUBS, SIDES, AdvancedCardPredictionModel, GlobalMedians,
+    _marking_risk_kernel, _marking_risk_numpy, calculate_derived_metrics, category_mask, top_k_indices
+)
+
+
+def _raw_team(name: str, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    nineties = rng.uniform(5, 30, 8).round(1)
+    return pd.DataFrame({
+        'Player': [f'{name} {i}' for i in range(8)],
+        'Squadra': name,
+        'Pos': ['CB', 'LB', 'RB', 'DM', 'CM', 'AM', 'FW', 'LW'],
+        'Falli Fatti Totali': (nineties * rng.uniform(0.5, 3.0, 8)).round(),
+        'Falli Subiti Totali': (nineties * rng.uniform(0.5, 3.0, 8)).round(),
+        'Cartellini Gialli Totali': rng.integers(1, 9, 8),
+        'Minuti Giocati Totali': nineties * 90,
+        '90s Giocati Totali': nineties,
+    })
+
+
+def _reference_player_risks(home, away, referee_yellows, ref_avg, critical_situations):
+    """Formule scalari per giocatore (rischio statistico, fattore ritardo, rischio critico e finale)."""
+    df = pd.concat([calculate_derived_metrics(home), calculate_derived_metrics(away)], ignore_index=True)
+    df = df.astype({col: np.float64 for col in df.select_dtypes('number').columns})
+    gm = {
+        'fouls_committed_90s': df['Media_Falli_Fatti_90s_Totale'].median(),
+        'fouls_suffered_90s': df['Media_Falli_Subiti_90s_Totale'].median(),
+        'games_per_card': df['Media_90s_per_Cartellino_Totale'].median(),
+        'fouls_per_card': df['Media_Falli_per_Cartellino_Totale'].median(),
+        'card_delay': df['Ritardo_Cartellino_Minuti'].median(),
+    }
+    team_avg = (df.groupby('Squadra')['Cartellini_Gialli_Totali'].mean() / 34.0).to_dict()
+    referee_factor = referee_yellows / ref_avg
+    rows = []
+    for row in df.itertuples(index=False):
+        risk = (row.Media_Falli_Fatti_90s_Totale / gm['fouls_committed_90s']) * 0.4
+        risk += (row.Media_Falli_Subiti_90s_Totale / gm['fouls_suffered_90s']) * 0.3
+        risk += (gm['games_per_card'] / max(row.Media_90s_per_Cartellino_Totale, 1e-6)) * 0.2
+        risk += (gm['fouls_per_card'] / max(row.Media_Falli_per_Cartellino_Totale, 1e-6)) * 0.2
+        risk += min(abs(team_avg[row.Squadra] - team_avg[row.Squadra]) * 0.1, 0.5)
+        statistical = risk * referee_factor
+
+        delay = 1.0
+        if row.Media_90s_per_Cartellino_Totale < gm['games_per_card']:
+            if row.Ritardo_Cartellino_Minuti > row.Media_90s_per_Cartellino_Totale * 30:
+                delay = 0.7
+            elif row.Ritardo_Cartellino_Minuti < gm['card_delay'] * 0.8:
+                delay = 1.3
+
+        critical = max([s['Situation_Risk'] for s in critical_situations
+                        if (s['Player'], s['Team']) == (row.Player, row.Squadra)
+                        or (s['Marker'], s['Marker_Team']) == (row.Player, row.Squadra)], default=0.0)
+        final = (statistical * 0.4 + critical * 0.6) * delay if critical > 0 else statistical * delay
+        rows.append((row.Player, statistical, delay, critical, final))
+    return pd.DataFrame(rows, columns=['Player', 'Rischio_Statistico', 'Delay_Factor', 'Rischio_Critico', 'Rischio_Finale'])
+
+
+def test_delay_factor_boundary_uses_float64_inputs():
+    # Il terzo giocatore ha 5/3 partite per cartellino e rango 3/8: ritardo interpolato esattamente 50.0
+    nineties = np.array([1.0, 1.5, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0])
+    raw = pd.DataFrame({
+        'Pos': 'MF', 'Falli Fatti Totali': 10.0, 'Falli Subiti Totali': 10.0,
+        'Cartellini Gialli Totali': [1, 1, 3, 1, 1, 1, 1, 1],
+        'Minuti Giocati Totali': nineties * 90, '90s Giocati Totali': nineties,
+    })
+    derived = calculate_derived_metrics(raw)
+    gm = GlobalMedians(1.0, 1.0, 6.5, 10.0, 100.0)
+
+    assert derived['Ritardo_Cartellino_Minuti'].dtype == np.float64
+    assert derived['Media_90s_per_Cartellino_Totale'].dtype == np.float64
+    assert derived['Ritardo_Cartellino_Minuti'][2] == 50.0
+    # 50.0 non supera (5/3) * 30 = 50.00000000000001: impulsivo (1.3), non calmo (0.7) come in float32
+    assert AdvancedCardPredictionModel()._delay_factor_vec(derived, gm)[2] == 1.3
+
+
+@pytest.mark.parametrize('with_critical', [True, False])
+def test_calculate_match_risk_matches_scalar_reference(with_critical):
+    home, away = _raw_team('Casa', 1), _raw_team('Ospiti', 2)
+    referees = pd.DataFrame({'Nome': ['Rossi', 'Bianchi'], 'Gialli ap (Media/Partita)': [4.5, 3.9]})
+    # Una soglia irraggiungibile esclude tutti i duelli: percorso senza rischio critico
+    model = AdvancedCardPredictionModel(compatibility_score_threshold=0.3 if with_critical else np.inf)
+
+    result = model.calculate_match_risk(home, away, referees)
+    risks = result['all_risks']
+    expected = _reference_player_risks(home, away, 4.5, 4.2, result['critical_situations'])
+
+    assert bool(result['critical_situations']) == with_critical
+    assert risks['Player'].tolist() == expected['Player'].tolist()
+    for col in ['Rischio_Statistico', 'Delay_Factor', 'Rischio_Finale']:
+        np.testing.assert_allclose(risks[col], expected[col], rtol=1e-12)
+    if with_critical:
+        np.testing.assert_allclose(risks['Rischio_Critico'], expected['Rischio_Critico'], rtol=1e-12)
+    else:
+        assert 'Rischio_Critico' not in risks.columns
+    top_4 = expected.sort_values('Rischio_Finale', ascending=False, kind='stable').head(4)
+    assert [p['Player'] for p in result['top_4_predictions']] == top_4['Player'].tolist()
+
+
+def test_top_k_indices_matches_stable_descending_sort():
+    for seed in range(20):
+        rng = np.random.default_rng(seed)
+        values = rng.choice([1.0, 2.0, 3.0, np.nan, np.inf, -np.inf], rng.integers(0, 14))
+        for k in (1, 4, 5):
+            # Ordinamento stabile su -values: parità per posizione di riga, -inf e NaN in coda
+            expected = np.argsort(-values, kind='stable')[:k]
+            np.testing.assert_array_equal(top_k_indices(values, k), expected)
+
+
+def test_top_k_indices_orders_ties_by_row_position():
+    values = np.array([2.0, 3.0, 3.0, 3.0, -np.inf])
+    np.testing.assert_array_equal(top_k_indices(values, 5), [1, 2, 3, 0, 4])
+    # -inf prima dei NaN, entrambi in coda in ordine di riga
+    values = np.array([np.nan, 1.0, -np.inf, np.nan, 1.0])
+    np.testing.assert_array_equal(top_k_indices(values, 5), [1, 4, 2, 0, 3])
+    np.testing.assert_array_equal(top_k_indices(values, 3), [1, 4, 2])
+
+
+def test_compatibility_table_matches_scalar_score():
+    # Una posizione reale per ogni categoria raggiungibile da _get_role_category
+    # (Central_Mid/Flank, Flank/Central e Other/Flank non sono prodotte da nessuna posizione)
+    position_by_role = {
+        ('Central_Mid', 'Central'): 'CM', ('Forward', 'Central'): 'ST', ('Forward', 'Flank'): 'FW,LW',
+        ('Defender', 'Central'): 'CB', ('Defender', 'Flank'): 'DF,RB', ('Flank', 'Flank'): 'RWB',
+        ('Other', 'Central'): 'GK',
+    }
+    positions = [position_by_role[(main, sub)] for main in ROLE_MAINS for sub in ROLE_SUBS
+                 if (main, sub) in position_by_role]
+    model = AdvancedCardPredictionModel()
+    role_codes, _ = model._encode_roles(pd.DataFrame({'Posizione_Primaria': positions, 'Heatmap': ''}))
+
+    for p_pos, p_role in zip(positions, role_codes):
+        for m_pos, m_role in zip(positions, role_codes):
+            for p_side_code, p_side in enumerate(SIDES):
+                for m_side_code, m_side in enumerate(SIDES):
+                    cell = (p_role, m_role, p_side_code, m_side_code)
+                    assert (model._comp_table[cell], model._comp_detail[cell]) == \
+                        model._calculate_compatibility_score(p_pos, m_pos, p_side, m_side)
+
+
+def test_category_mask_matches_per_row_predicate():
+    positions = pd.Series(['FW', 'DF', 'FW,MF', np.nan, 'MF', 'DF'])
+    expected = positions.map(lambda pos: isinstance(pos, str) and 'FW' in pos).to_numpy()
+    np.testing.assert_array_equal(category_mask(positions, lambda pos: 'FW' in pos), expected)
+
+
+@pytest.mark.skipif(not NUMBA_AVAILABLE, reason='numba non installato: il kernel è già la versione NumPy')
+@pytest.mark.parametrize('seed', range(20))
+def test_marking_risk_kernel_matches_numpy(seed):
+    rng = np.random.default_rng(seed)
+    n_p, n_m = rng.integers(1, 8), rng.integers(1, 10)
+    args = (
+        rng.uniform(0, 4, n_p), rng.uniform(0, 4, n_m), rng.uniform(0, 2, n_m),
+        rng.choice([0.7, 1.0, 1.3], n_p), rng.choice([0.7, 1.0, 1.3], n_m),
+        rng.integers(0, 10, n_p), rng.integers(0, 10, n_m),
+        rng.integers(0, 3, n_p), rng.integers(0, 3, n_m),
+        rng.random((n_p, n_m)) < 0.8,
+        rng.choice([0.3, 0.5, 0.7, 0.8, 1.0], (10, 10, 3, 3)),
+        2.5, 0.3,
+    )
+    for got, expected in zip(_marking_risk_kernel(*args), _marking_risk_numpy(*args)):
+        np.testing.assert_allclose(got, expected, rtol=1e-12)